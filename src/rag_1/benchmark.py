@@ -0,0 +1,177 @@
+import argparse
+import os
+import time
+from typing import List
+
+import faiss
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+from rag_1.search import NormalSearch
+from rag_1.utils import CONFIG
+
+
+def make_searcher(num_vectors: int, dim: int, seed: int = 0) -> NormalSearch:
+    """
+    説明
+    ----------
+    ランダムなベクトルでNormalSearchを作成する関数
+    エンベディングモデルを使わずに検索だけの速度を測るために使う
+
+    Parameter
+    ----------
+    num_vectors : int
+        ベクトル数
+    dim : int
+        次元数
+    seed : int = 0
+        乱数のシード
+
+    Returns
+    ----------
+    NormalSearch
+        分割していないNormalSearch
+    """
+
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((num_vectors, dim)).astype(np.float32)
+
+    index = faiss.IndexFlatL2(dim)
+    index.add(vectors)
+
+    ids = [str(i) for i in range(num_vectors)]
+    docstore = InMemoryDocstore(
+        {id: Document(page_content="", metadata={"title": ""}) for id in ids}
+    )
+
+    # 分割していない状態を基準にするため、設定に関係なく分割数は1にする
+    config = {**CONFIG, "NormalSearch": {**CONFIG["NormalSearch"], "n_shards": 1}}
+    searcher = NormalSearch.from_vectorstore(
+        vectorstore=FAISS(
+            embedding_function=None,
+            index=index,
+            docstore=docstore,
+            index_to_docstore_id=dict(enumerate(ids)),
+        ),
+        config=config,
+        index_key="benchmark",
+    )
+
+    return searcher
+
+
+def measure(
+    searcher: NormalSearch, queries: np.ndarray, tops: int, repeat: int
+) -> float:
+    """
+    説明
+    ----------
+    検索にかかる時間の中央値を測る関数
+
+    Parameter
+    ----------
+    searcher : NormalSearch
+        検索クラス
+    queries : np.ndarray
+        クエリの埋め込み
+    tops : int
+        検索上位の何個を結果に含めるか
+    repeat : int
+        測定回数
+
+    Returns
+    ----------
+    float
+        1回の検索(全クエリ)にかかった時間の中央値(ミリ秒)
+    """
+
+    times = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        searcher._search_by_vectors(vectors=queries, tops=tops)
+        times.append((time.perf_counter() - start_time) * 1000)
+
+    return float(np.median(times))
+
+
+def main(
+    num_vectors: int,
+    dim: int,
+    num_queries: int,
+    tops: int,
+    shards: List[int],
+    repeat: int,
+) -> None:
+    """
+    説明
+    ----------
+    シャード数ごとの検索時間を測り、分割しない場合と結果が一致するか確認する
+
+    Parameter
+    ----------
+    num_vectors : int
+        ベクトル数
+    dim : int
+        次元数
+    num_queries : int
+        クエリ数
+    tops : int
+        検索上位の何個を結果に含めるか
+    shards : List[int]
+        測定するシャード数
+    repeat : int
+        測定回数
+    """
+
+    searcher = make_searcher(num_vectors=num_vectors, dim=dim)
+    rng = np.random.default_rng(1)
+    queries = rng.standard_normal((num_queries, dim)).astype(np.float32)
+
+    expected = searcher._search_by_vectors(vectors=queries, tops=tops)
+    baseline = measure(searcher=searcher, queries=queries, tops=tops, repeat=repeat)
+
+    print(f"CPU数: {os.cpu_count()}, FAISSのスレッド数: {faiss.omp_get_max_threads()}")
+    print(f"ベクトル数: {num_vectors}, 次元数: {dim}, クエリ数: {num_queries}, tops: {tops}")
+    print("shards\tlatency_ms\tspeedup\tidentical")
+    print(f"-\t{baseline:.2f}\t1.00\tTrue")
+
+    for n_shards in shards:
+        searcher.shard(n_shards=n_shards)
+        latency = measure(searcher=searcher, queries=queries, tops=tops, repeat=repeat)
+        results = searcher._search_by_vectors(vectors=queries, tops=tops)
+        identical = [[id for id, _ in hits] for hits in results] == [
+            [id for id, _ in hits] for hits in expected
+        ]
+        print(f"{n_shards}\t{latency:.2f}\t{baseline / latency:.2f}\t{identical}")
+        searcher.shards = None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="シャード数ごとの検索時間を測る")
+    parser.add_argument("--num-vectors", type=int, default=200000)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--num-queries", type=int, default=32)
+    parser.add_argument("--tops", type=int, default=10)
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--faiss-threads",
+        type=int,
+        default=None,
+        help="FAISS内部のスレッド数(既定は本番と同じFAISSの既定値)",
+    )
+    args = parser.parse_args()
+
+    if args.faiss_threads is not None:
+        faiss.omp_set_num_threads(args.faiss_threads)
+
+    main(
+        num_vectors=args.num_vectors,
+        dim=args.dim,
+        num_queries=args.num_queries,
+        tops=args.tops,
+        shards=args.shards,
+        repeat=args.repeat,
+    )
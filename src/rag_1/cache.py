@@ -0,0 +1,229 @@
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from rag_1.utils import CONFIG
+
+
+class RetrievalCache:
+    """
+    Attributes
+    ----------
+    self.path : str
+        キャッシュを保存するsqliteファイルのpath
+
+    method
+    ----------
+    get_embeddings(self, model_name: str, queries: List[str]) -> Dict[str, np.ndarray]
+        クエリの埋め込みをキャッシュから取り出すメソッド
+
+    put_embeddings(self, model_name: str, embeddings: Dict[str, np.ndarray]) -> None
+        クエリの埋め込みをキャッシュに保存するメソッド
+
+    get_results(self, index_key: str, query: str) -> Optional[Tuple[List[str], List[float]]]
+        検索結果をキャッシュから取り出すメソッド
+
+    put_results(self, index_key: str, results: Dict[str, Tuple[List[str], List[float]]]) -> None
+        複数のクエリの検索結果をまとめてキャッシュに保存するメソッド
+
+    clear(self, index_key: str) -> None
+        インデックスの検索結果を削除するメソッド
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        説明
+        ----------
+        クエリの埋め込みと検索結果をsqliteに保存するキャッシュ
+        埋め込みはエンベディングモデルごと、検索結果はインデックスごとに保存する
+        検索結果はこれまでで最も深い件数だけを保存し、少ない件数はその先頭を返す
+
+        Parameters
+        ----------
+        path : str
+            キャッシュを保存するsqliteファイルのpath
+        """
+
+        self.path = path
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        説明
+        ----------
+        初めて使われた時にsqliteファイルを開き、テーブルを作成するメソッド
+
+        Returns
+        ----------
+        sqlite3.Connection
+            コネクション
+        """
+
+        if self._connection is None:
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "model_name TEXT, query TEXT, vector BLOB, "
+                "PRIMARY KEY (model_name, query))"
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "index_key TEXT, query TEXT, ids TEXT, scores TEXT, "
+                "PRIMARY KEY (index_key, query))"
+            )
+            self._connection.commit()
+
+        return self._connection
+
+    def get_embeddings(
+        self, model_name: str, queries: List[str]
+    ) -> Dict[str, np.ndarray]:
+        """
+        説明
+        ----------
+        クエリの埋め込みをキャッシュから取り出すメソッド
+
+        Parameters
+        ----------
+        model_name : str
+            エンベディングモデル名
+        queries : List[str]
+            クエリのリスト
+
+        Returns
+        ----------
+        Dict[str, np.ndarray]
+            キャッシュにあったクエリとその埋め込み
+        """
+
+        embeddings = {}
+
+        with self._lock:
+            connection = self._connect()
+            for query in set(queries):
+                row = connection.execute(
+                    "SELECT vector FROM embeddings WHERE model_name = ? AND query = ?",
+                    (model_name, query),
+                ).fetchone()
+                if row is not None:
+                    embeddings[query] = np.frombuffer(row[0], dtype=np.float32)
+
+        return embeddings
+
+    def put_embeddings(
+        self, model_name: str, embeddings: Dict[str, np.ndarray]
+    ) -> None:
+        """
+        説明
+        ----------
+        クエリの埋め込みをキャッシュに保存するメソッド
+
+        Parameters
+        ----------
+        model_name : str
+            エンベディングモデル名
+        embeddings : Dict[str, np.ndarray]
+            クエリとその埋め込み
+        """
+
+        with self._lock:
+            connection = self._connect()
+            connection.executemany(
+                "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)",
+                [
+                    (model_name, query, np.asarray(vector, dtype=np.float32).tobytes())
+                    for query, vector in embeddings.items()
+                ],
+            )
+            connection.commit()
+
+    def get_results(
+        self, index_key: str, query: str
+    ) -> Optional[Tuple[List[str], List[float]]]:
+        """
+        説明
+        ----------
+        検索結果をキャッシュから取り出すメソッド
+
+        Parameters
+        ----------
+        index_key : str
+            インデックスのキー
+        query : str
+            クエリ
+
+        Returns
+        ----------
+        Optional[Tuple[List[str], List[float]]]
+            ドキュメントのidとスコア(キャッシュにない場合はNone)
+        """
+
+        with self._lock:
+            row = (
+                self._connect()
+                .execute(
+                    "SELECT ids, scores FROM results WHERE index_key = ? AND query = ?",
+                    (index_key, query),
+                )
+                .fetchone()
+            )
+
+        if row is None:
+            return None
+
+        return json.loads(row[0]), json.loads(row[1])
+
+    def put_results(
+        self, index_key: str, results: Dict[str, Tuple[List[str], List[float]]]
+    ) -> None:
+        """
+        説明
+        ----------
+        複数のクエリの検索結果をまとめてキャッシュに保存するメソッド
+        1回のトランザクションで書き込むので、commitはクエリの数によらず1回になる
+
+        Parameters
+        ----------
+        index_key : str
+            インデックスのキー
+        results : Dict[str, Tuple[List[str], List[float]]]
+            クエリとその検索結果のドキュメントのid(スコア順)とスコア
+        """
+
+        with self._lock:
+            connection = self._connect()
+            connection.executemany(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                [
+                    (index_key, query, json.dumps(ids), json.dumps(scores))
+                    for query, (ids, scores) in results.items()
+                ],
+            )
+            connection.commit()
+
+    def clear(self, index_key: str) -> None:
+        """
+        説明
+        ----------
+        インデックスの検索結果をキャッシュから削除するメソッド
+        インデックスを作り直した時に使う
+
+        Parameters
+        ----------
+        index_key : str
+            インデックスのキー
+        """
+
+        with self._lock:
+            connection = self._connect()
+            connection.execute("DELETE FROM results WHERE index_key = ?", (index_key,))
+            connection.commit()
+
+
+RETRIEVAL_CACHE = RetrievalCache(path=CONFIG["RetrievalCache"]["path"])
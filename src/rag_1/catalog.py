@@ -0,0 +1,285 @@
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterable, List
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from rag_1.chunks import ChunkStore
+
+# チャンクの一覧のParquetファイルの列(chunk_idはベクトルストアのidと同じ)
+CHUNK_CATALOG_SCHEMA = pa.schema(
+    [
+        ("chunk_id", pa.int64()),
+        ("title", pa.string()),
+        ("document", pa.string()),
+        ("start_index", pa.int32()),
+        ("length", pa.int32()),
+    ]
+)
+
+# インデックスのバージョンのディレクトリに保存するチャンクの一覧のファイル名
+CATALOG_FILE_NAME = "chunk.parquet"
+
+
+def get_catalog_dir(mode: str) -> str:
+    """
+    説明
+    ----------
+    modeに対応するチャンクの一覧のcsv,xlsxファイルを書き出すディレクトリを返す。
+
+    Parameter
+    ----------
+    mode : str
+        検証用かテスト用か区別するためのもの
+
+    Returns
+    ----------
+    str
+        ディレクトリのpath
+    """
+
+    if mode == "valid":
+        return "dataset/chunk/valid"
+    elif mode == "test":
+        return "dataset/chunk/test"
+
+    raise ValueError(f"modeは'valid'か'test'を指定してください: {mode}")
+
+
+def count_rows(path: str) -> int:
+    """
+    説明
+    ----------
+    チャンクの一覧のParquetファイルの行数を返す。
+    フッターのメタデータだけを読むので、ファイルが大きくてもすぐに終わる
+
+    Parameter
+    ----------
+    path : str
+        Parquetファイルのpath
+
+    Returns
+    ----------
+    int
+        行数(チャンク数)
+    """
+
+    return pq.read_metadata(path).num_rows
+
+
+class ChunkCatalogWriter:
+    """
+    Attributes
+    ----------
+    self.path : str
+        Parquetファイルのpath
+
+    self.closed : bool
+        closeまたはabortが済んだかどうか
+
+    method
+    ----------
+    write(self, store: ChunkStore, start: int, end: int) -> None
+        チャンクをParquetファイルに追記するメソッド
+
+    close(self) -> None
+        書き込みが終わるのを待ってParquetファイルを閉じるメソッド
+
+    abort(self) -> None
+        書き込みを止めて一時ファイルを削除するメソッド
+    """
+
+    def __init__(
+        self, path: str, background: bool = True, max_pending: int = 2
+    ) -> None:
+        """
+        説明
+        ----------
+        チャンクを少しずつParquetファイルに書き込むクラス
+        backgroundがTrueの場合は書き込みを別スレッドで行い、エンベディングを待たせない
+        書き込み中は一時ファイルに書き、closeで置き換える
+
+        Parameters
+        ----------
+        path : str
+            Parquetファイルのpath
+        background : bool = True
+            書き込みを別スレッドで行うかどうか
+        max_pending : int = 2
+            書き込み待ちにできるバッチの数
+            書き込みがエンベディングに追いつかない場合はここで待ち、メモリ使用量を抑える
+        """
+
+        self.path = path
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+
+        self.closed = False
+        self.max_pending = max_pending
+        self._temporary_path = f"{self.path}.tmp"
+        self._writer = pq.ParquetWriter(
+            self._temporary_path, CHUNK_CATALOG_SCHEMA, compression="zstd"
+        )
+        self._executor = ThreadPoolExecutor(max_workers=1) if background else None
+        self._futures: List[Future] = []
+
+    def write(self, store: ChunkStore, start: int, end: int) -> None:
+        """
+        説明
+        ----------
+        チャンクをParquetファイルに追記するメソッド
+        列はChunkStoreの配列から切り出してコピーするので、別スレッドでの書き込み中に
+        チャンクが追加されても影響しない
+
+        Parameters
+        ----------
+        store : ChunkStore
+            チャンクを保持しているChunkStore
+        start : int
+            書き込む最初のチャンクの番号
+        end : int
+            書き込む最後のチャンクの次の番号
+        """
+
+        documents = [store.text(chunk=chunk) for chunk in range(start, end)]
+        columns = {
+            "chunk_id": np.arange(start, end),
+            "title": np.asarray(store.titles, dtype=object)[store.title_ids[start:end]],
+            "document": documents,
+            "start_index": store.start_indices[start:end].copy(),
+            "length": np.fromiter(map(len, documents), dtype=np.int32),
+        }
+
+        if self._executor is None:
+            self._write(columns=columns)
+            return
+
+        self._futures.append(self._executor.submit(self._write, columns=columns))
+
+        # 書き終わったものは捨て、待ちが多すぎる場合は古いものが終わるまで待つ
+        self._futures = [future for future in self._futures if not future.done()]
+        while len(self._futures) > self.max_pending:
+            self._futures.pop(0).result()
+
+    def _write(self, columns: Dict[str, Any]) -> None:
+        """
+        説明
+        ----------
+        チャンクを1つのrow groupとして書き込むメソッド
+
+        Parameters
+        ----------
+        columns : Dict[str, Any]
+            writeで切り出した各列
+        """
+
+        # 開始位置が無いチャンク(-1)は欠損値にする
+        start_indices = columns["start_index"]
+        table = pa.table(
+            {
+                "chunk_id": columns["chunk_id"],
+                "title": columns["title"],
+                "document": columns["document"],
+                "start_index": pa.array(start_indices, mask=start_indices == -1),
+                "length": columns["length"],
+            },
+            schema=CHUNK_CATALOG_SCHEMA,
+        )
+        self._writer.write_table(table)
+
+    def close(self) -> None:
+        """
+        説明
+        ----------
+        書き込みが終わるのを待ってParquetファイルを閉じるメソッド
+        書き込みに失敗した場合は一時ファイルを削除してからエラーを送出する
+        """
+
+        try:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                # 書き込み中のエラーはここで送出する
+                for future in self._futures:
+                    future.result()
+
+            self._writer.close()
+            os.replace(self._temporary_path, self.path)
+        except BaseException:
+            self.abort()
+            raise
+
+        self.closed = True
+
+    def abort(self) -> None:
+        """
+        説明
+        ----------
+        書き込みを止めて一時ファイルを削除するメソッド
+        close済みの場合は何もしない
+        """
+
+        if self.closed:
+            return
+        self.closed = True
+
+        if self._executor is not None:
+            for future in self._futures:
+                future.cancel()
+            self._executor.shutdown(wait=True)
+
+        try:
+            self._writer.close()
+        finally:
+            if os.path.exists(self._temporary_path):
+                os.remove(self._temporary_path)
+
+
+def export_catalog(
+    path: str, mode: str = "valid", formats: Iterable[str] = ("csv", "xlsx")
+) -> List[str]:
+    """
+    説明
+    ----------
+    チャンクの一覧のParquetファイルからcsv,xlsxファイルを作成する
+
+    Parameter
+    ----------
+    path : str
+        チャンクの一覧のParquetファイルのpath(インデックスのバージョンのディレクトリにある)
+    mode : str = "valid"
+        検証用かテスト用か区別するためのもの(書き出し先のディレクトリを決める)
+    formats : Iterable[str] = ("csv", "xlsx")
+        作成するファイルの形式
+
+    Returns
+    ----------
+    List[str]
+        作成したファイルのpath
+    """
+
+    if not os.path.isfile(path):
+        raise FileNotFoundError(
+            f"チャンクの一覧が見つかりません。ChunkCatalogを有効にしてインデックスを作成し直してください: {path}"
+        )
+
+    # start_indexが無いチャンクも整数の列のまま読み込む
+    df = pd.read_parquet(path, dtype_backend="numpy_nullable")
+
+    directory = get_catalog_dir(mode=mode)
+    Path(directory).mkdir(parents=True, exist_ok=True)
+
+    paths = []
+    for file_format in formats:
+        output_path = os.path.join(directory, f"chunk.{file_format}")
+        if file_format == "csv":
+            df.to_csv(output_path, index=False)
+        elif file_format == "xlsx":
+            df.to_excel(output_path, index=False)
+        else:
+            raise ValueError(f"formatは'csv'か'xlsx'を指定してください: {file_format}")
+        paths.append(output_path)
+
+    return paths
@@ -0,0 +1,494 @@
+from array import array
+from typing import Any, Dict, Iterable, List, Optional, Union
+
+import numpy as np
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_core.documents import Document
+
+
+class ChunkStore:
+    """
+    Attributes
+    ----------
+    self.titles : List[str]
+        タイトルの一覧(各チャンクはこのリストの番号を持つ)
+
+    method
+    ----------
+    append(self, text: str, title: str, start_index: Optional[int]) -> int
+        チャンクを追加するメソッド
+
+    add_duplicate(self, chunk: int, title: str, start_index: Optional[int], length: int) -> None
+        重複除去でまとめたチャンクの元の位置を追加するメソッド
+
+    delete(self, chunk: int) -> None
+        チャンクに削除済みの印を付けるメソッド
+
+    is_deleted(self, chunk: int) -> bool
+        チャンクが削除済みかどうかを返すメソッド
+
+    flush(self) -> None
+        追加待ちの文章を連結した文字列にまとめるメソッド
+
+    text(self, chunk: int) -> str
+        チャンクの文章を返すメソッド
+
+    to_document(self, chunk: int) -> Document
+        チャンクをDocumentに変換するメソッド
+    """
+
+    __slots__ = (
+        "titles",
+        "_title_numbers",
+        "_text",
+        "_pending",
+        "_offsets",
+        "_start_indices",
+        "_title_ids",
+        "_duplicates",
+        "_duplicate_title_ids",
+        "_duplicate_start_indices",
+        "_duplicate_lengths",
+        "_deleted",
+    )
+
+    def __init__(self) -> None:
+        """
+        説明
+        ----------
+        チャンクを配列でまとめて保持するクラス
+        文章は1つの文字列に連結してオフセットで区切り、開始位置とタイトルの番号は
+        int32の配列で持つ。Documentはto_documentで必要な時だけ作成する
+        """
+
+        self.titles: List[str] = []
+        self._title_numbers: Dict[str, int] = {}
+        self._text = ""
+        self._pending: List[str] = []
+        self._offsets = array("q", [0])
+        self._start_indices = array("i")
+        self._title_ids = array("i")
+        self._duplicates: Dict[int, List[int]] = {}
+        self._duplicate_title_ids = array("i")
+        self._duplicate_start_indices = array("i")
+        self._duplicate_lengths = array("i")
+        self._deleted = bytearray()
+
+    def __len__(self) -> int:
+        """
+        説明
+        ----------
+        チャンク数を返す(削除済みのチャンクを含む)
+        """
+
+        return len(self._start_indices)
+
+    def __getstate__(self) -> Dict[str, Any]:
+        """
+        説明
+        ----------
+        pickle化する前に追加待ちの文章をまとめ、チャンクごとの文字列を保存しない
+        """
+
+        self.flush()
+
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        """
+        説明
+        ----------
+        __getstate__で保存した属性を復元する
+        """
+
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def _title_id(self, title: str) -> int:
+        """
+        説明
+        ----------
+        タイトルの番号を返すメソッド(初めてのタイトルは追加する)
+
+        Parameters
+        ----------
+        title : str
+            タイトル
+
+        Returns
+        ----------
+        int
+            タイトルの番号
+        """
+
+        if title not in self._title_numbers:
+            self._title_numbers[title] = len(self.titles)
+            self.titles.append(title)
+
+        return self._title_numbers[title]
+
+    def append(self, text: str, title: str, start_index: Optional[int]) -> int:
+        """
+        説明
+        ----------
+        チャンクを追加するメソッド
+
+        Parameters
+        ----------
+        text : str
+            チャンクの文章
+        title : str
+            タイトル
+        start_index : Optional[int]
+            元の文章での開始位置(無い場合は-1として保存する)
+
+        Returns
+        ----------
+        int
+            追加したチャンクの番号
+        """
+
+        self._pending.append(text)
+        self._offsets.append(self._offsets[-1] + len(text))
+        self._start_indices.append(-1 if start_index is None else start_index)
+        self._title_ids.append(self._title_id(title=title))
+        self._deleted.append(0)
+
+        return len(self) - 1
+
+    def add_duplicate(
+        self, chunk: int, title: str, start_index: Optional[int], length: int
+    ) -> None:
+        """
+        説明
+        ----------
+        重複除去でまとめたチャンクの元の位置を追加するメソッド
+
+        Parameters
+        ----------
+        chunk : int
+            代表のチャンクの番号
+        title : str
+            取り除いたチャンクのタイトル
+        start_index : Optional[int]
+            取り除いたチャンクの開始位置
+        length : int
+            取り除いたチャンクの文字数
+        """
+
+        self._duplicates.setdefault(chunk, []).append(len(self._duplicate_lengths))
+        self._duplicate_title_ids.append(self._title_id(title=title))
+        self._duplicate_start_indices.append(-1 if start_index is None else start_index)
+        self._duplicate_lengths.append(length)
+
+    def delete(self, chunk: int) -> None:
+        """
+        説明
+        ----------
+        チャンクに削除済みの印を付けるメソッド
+        文章や配列は詰めずに残すので、他のチャンクの番号は変わらない
+
+        Parameters
+        ----------
+        chunk : int
+            チャンクの番号
+        """
+
+        self._deleted[chunk] = 1
+
+    def is_deleted(self, chunk: int) -> bool:
+        """
+        説明
+        ----------
+        チャンクが削除済みかどうかを返すメソッド
+
+        Parameters
+        ----------
+        chunk : int
+            チャンクの番号
+
+        Returns
+        ----------
+        bool
+            削除済みであればTrue
+        """
+
+        return self._deleted[chunk] == 1
+
+    def flush(self) -> None:
+        """
+        説明
+        ----------
+        追加待ちの文章を連結した文字列にまとめるメソッド
+        連結のたびに全体をコピーするので、チャンクを追加するたびではなく
+        インデックスの作成の最後や保存の前にまとめて呼ぶ
+        """
+
+        if len(self._pending) > 0:
+            self._text = self._text + "".join(self._pending)
+            self._pending = []
+
+    @property
+    def start_indices(self) -> np.ndarray:
+        """
+        説明
+        ----------
+        各チャンクの開始位置(int32)
+        """
+
+        return np.frombuffer(self._start_indices, dtype=np.int32)
+
+    @property
+    def title_ids(self) -> np.ndarray:
+        """
+        説明
+        ----------
+        各チャンクのタイトルの番号(int32)
+        """
+
+        return np.frombuffer(self._title_ids, dtype=np.int32)
+
+    @property
+    def lengths(self) -> np.ndarray:
+        """
+        説明
+        ----------
+        各チャンクの文字数
+        """
+
+        return np.diff(np.frombuffer(self._offsets, dtype=np.int64))
+
+    def text(self, chunk: int) -> str:
+        """
+        説明
+        ----------
+        チャンクの文章を返すメソッド
+
+        Parameters
+        ----------
+        chunk : int
+            チャンクの番号
+
+        Returns
+        ----------
+        str
+            チャンクの文章
+        """
+
+        # まだ連結していないチャンクは追加待ちのリストから返す
+        flushed = len(self) - len(self._pending)
+        if chunk >= flushed:
+            return self._pending[chunk - flushed]
+
+        return self._text[self._offsets[chunk] : self._offsets[chunk + 1]]
+
+    def to_document(self, chunk: int) -> Document:
+        """
+        説明
+        ----------
+        チャンクをDocumentに変換するメソッド
+        メタデータは分割時と同じ形式(title, start_index, 重複があればduplicates)にする
+
+        Parameters
+        ----------
+        chunk : int
+            チャンクの番号
+
+        Returns
+        ----------
+        Document
+            Document型のデータ
+        """
+
+        start_index = self._start_indices[chunk]
+        metadata: Dict[str, Any] = {
+            "title": self.titles[self._title_ids[chunk]],
+            "start_index": None if start_index == -1 else start_index,
+        }
+
+        if chunk in self._duplicates:
+            metadata["duplicates"] = [
+                {
+                    "title": self.titles[self._duplicate_title_ids[i]],
+                    "start_index": (
+                        None
+                        if self._duplicate_start_indices[i] == -1
+                        else self._duplicate_start_indices[i]
+                    ),
+                    "length": self._duplicate_lengths[i],
+                }
+                for i in self._duplicates[chunk]
+            ]
+
+        return Document(page_content=self.text(chunk=chunk), metadata=metadata)
+
+
+class ChunkDocstore(Docstore, AddableMixin):
+    """
+    Attributes
+    ----------
+    self.store : ChunkStore
+        チャンクを保持する配列
+
+    method
+    ----------
+    add(self, texts: Dict[str, Document]) -> None
+        Documentを追加するメソッド
+
+    delete(self, ids: List) -> None
+        Documentを削除するメソッド
+
+    search(self, search: str) -> Union[str, Document]
+        idからDocumentを作成して返すメソッド
+
+    chunk_numbers(self, ids: Iterable[str]) -> np.ndarray
+        idをチャンクの番号に変換するメソッド
+    """
+
+    def __init__(self, store: Optional[ChunkStore] = None) -> None:
+        """
+        説明
+        ----------
+        FAISSのdocstoreとして使うクラス
+        InMemoryDocstoreのようにDocumentを保持せず、ChunkStoreに配列として保持する
+        チャンクの番号の文字列をidとする場合は対応を持たず、
+        それ以外のid(uuidなど)を使った場合だけidとチャンクの番号の対応を辞書で持つ
+
+        Parameters
+        ----------
+        store : Optional[ChunkStore] = None
+            チャンクを保持する配列
+        """
+
+        self.store = store if store is not None else ChunkStore()
+        self._chunks: Dict[str, int] = {}
+        self._ids: Dict[int, str] = {}
+
+    def _chunk(self, id: str) -> Optional[int]:
+        """
+        説明
+        ----------
+        idに対応する削除されていないチャンクの番号を返すメソッド
+
+        Parameters
+        ----------
+        id : str
+            id
+
+        Returns
+        ----------
+        Optional[int]
+            チャンクの番号(存在しない場合はNone)
+        """
+
+        if id in self._chunks:
+            chunk = self._chunks[id]
+        elif id.isdigit() and int(id) < len(self.store) and int(id) not in self._ids:
+            chunk = int(id)
+        else:
+            return None
+
+        if self.store.is_deleted(chunk=chunk):
+            return None
+
+        return chunk
+
+    def add(self, texts: Dict[str, Document]) -> None:
+        """
+        説明
+        ----------
+        Documentを追加するメソッド
+        InMemoryDocstoreと同じく、既に存在するidを追加しようとした場合はエラーにする
+
+        Parameters
+        ----------
+        texts : Dict[str, Document]
+            idとDocument
+        """
+
+        overlapping = [id for id in texts if self._chunk(id=id) is not None]
+        if len(overlapping) > 0:
+            raise ValueError(f"Tried to add ids that already exist: {overlapping}")
+
+        for id, doc in texts.items():
+            chunk = self.store.append(
+                text=doc.page_content,
+                title=doc.metadata.get("title", ""),
+                start_index=doc.metadata.get("start_index"),
+            )
+            if id != str(chunk):
+                self._chunks[id] = chunk
+                self._ids[chunk] = id
+
+    def delete(self, ids: List) -> None:
+        """
+        説明
+        ----------
+        Documentを削除するメソッド
+        チャンクには削除済みの印を付けるだけで、他のチャンクの番号は変わらない
+
+        Parameters
+        ----------
+        ids : List
+            削除するid
+        """
+
+        chunks: Dict[str, int] = {}
+        missing = []
+        for id in ids:
+            chunk = self._chunk(id=id)
+            if chunk is None:
+                missing.append(id)
+            else:
+                chunks[id] = chunk
+        if len(missing) > 0:
+            raise ValueError(f"Did not find ids: {missing}")
+
+        for id, chunk in chunks.items():
+            self.store.delete(chunk=chunk)
+            self._chunks.pop(id, None)
+
+    def search(self, search: str) -> Union[str, Document]:
+        """
+        説明
+        ----------
+        idからDocumentを作成して返すメソッド
+
+        Parameters
+        ----------
+        search : str
+            id
+
+        Returns
+        ----------
+        Union[str, Document]
+            Document(存在しない場合はInMemoryDocstoreと同じメッセージ)
+        """
+
+        chunk = self._chunk(id=search)
+        if chunk is None:
+            return f"ID {search} not found."
+
+        return self.store.to_document(chunk=chunk)
+
+    def chunk_numbers(self, ids: Iterable[str]) -> np.ndarray:
+        """
+        説明
+        ----------
+        idをチャンクの番号に変換するメソッド
+
+        Parameters
+        ----------
+        ids : Iterable[str]
+            存在するid
+
+        Returns
+        ----------
+        np.ndarray
+            チャンクの番号
+        """
+
+        return np.array(
+            [self._chunks[id] if id in self._chunks else int(id) for id in ids],
+            dtype=np.int64,
+        )
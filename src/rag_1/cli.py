@@ -0,0 +1,411 @@
+import argparse
+import csv
+import json
+import os
+import sys
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, TextIO
+
+from langchain_core.documents import Document
+
+from rag_1.catalog import CATALOG_FILE_NAME, export_catalog
+from rag_1.generation import GoogleGemini
+from rag_1.registry import REGISTRY
+from rag_1.search import NormalSearch
+from rag_1.utils import batched
+from rag_1.validation import Validation
+
+
+def read_queries(file: TextIO, input_format: str) -> Iterator[Dict]:
+    """
+    説明
+    ----------
+    JSONLまたはCSVから1行ずつクエリを読み込むジェネレータ
+    クエリは"query"または"problem"の列から取り出す
+
+    Parameter
+    ----------
+    file : TextIO
+        入力ファイル
+    input_format : str
+        "jsonl"か"csv"
+
+    Returns
+    ----------
+    Iterator[Dict]
+        クエリを"query"に持つ各行
+    """
+
+    if input_format == "csv":
+        rows: Iterable = csv.DictReader(file)
+    else:
+        rows = (json.loads(line) for line in file if line.strip())
+
+    for row in rows:
+        if isinstance(row, str):
+            row = {"query": row}
+        row["query"] = row.get("query") or row.get("problem")
+        yield row
+
+
+def run_batches(
+    batches: Iterable[List[Dict]],
+    func: Callable[[List[Dict]], List[Dict]],
+    workers: int,
+) -> Iterator[Dict]:
+    """
+    説明
+    ----------
+    バッチを並列に処理し、終わったものから結果を返すジェネレータ
+    処理中のバッチはworkers個までに抑えるので、入力の大きさに関わらずメモリは一定
+
+    Parameter
+    ----------
+    batches : Iterable[List[Dict]]
+        バッチ
+    func : Callable[[List[Dict]], List[Dict]]
+        1バッチを処理する関数
+    workers : int
+        同時に処理するバッチ数
+
+    Returns
+    ----------
+    Iterator[Dict]
+        各行の結果
+    """
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending: set = set()
+        for batch in batches:
+            if len(pending) >= workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield from future.result()
+            pending.add(executor.submit(func, batch))
+
+        for future in wait(pending).done:
+            yield from future.result()
+
+
+def document_to_dict(doc: Document) -> Dict:
+    """
+    説明
+    ----------
+    Documentを出力用の辞書に変換する
+
+    Parameter
+    ----------
+    doc : Document
+        ドキュメント
+
+    Returns
+    ----------
+    Dict
+        タイトル・開始位置・本文
+    """
+
+    return {
+        "title": doc.metadata.get("title"),
+        "start_index": doc.metadata.get("start_index"),
+        "page_content": doc.page_content,
+    }
+
+
+def to_index_text(value: object) -> Optional[str]:
+    """
+    説明
+    ----------
+    start_index・end_indexを空白区切りの文字列に揃える
+    JSONLでは数値、CSVでは文字列になるため、Validation.rankingに渡す前に型を統一する
+
+    Parameter
+    ----------
+    value : object
+        入力の値(数値または空白区切りの数字)
+
+    Returns
+    ----------
+    Optional[str]
+        空白区切りの数字(空や数字でない場合はNone)
+    """
+
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return str(value)
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    if isinstance(value, str):
+        parts = value.split()
+        if len(parts) > 0 and all(part.isdigit() for part in parts):
+            return " ".join(parts)
+
+    return None
+
+
+def build_command(args: argparse.Namespace) -> Iterator[Dict]:
+    """
+    説明
+    ----------
+    ベクトルストアを作成して保存する
+    """
+
+    searcher = NormalSearch(mode=args.mode)
+    searcher.save()
+
+    yield {"mode": args.mode, "index_key": searcher.index_key}
+
+
+def catalog_command(args: argparse.Namespace) -> Iterator[Dict]:
+    """
+    説明
+    ----------
+    チャンクの一覧のParquetファイルからcsv,xlsxファイルを作成する
+    Parquetファイルは現在のバージョンのインデックスと一緒に保存されたものを使う
+    """
+
+    catalog_path = os.path.join(REGISTRY.resolve(mode=args.mode), CATALOG_FILE_NAME)
+    for path in export_catalog(path=catalog_path, mode=args.mode, formats=args.formats):
+        yield {"mode": args.mode, "path": path}
+
+
+def search_command(args: argparse.Namespace) -> Iterator[Dict]:
+    """
+    説明
+    ----------
+    各クエリに関連するドキュメントを検索する
+    """
+
+    searcher = NormalSearch.load(mode=args.mode)
+    if args.watch:
+        searcher.watch()
+
+    def func(batch: List[Dict]) -> List[Dict]:
+        results = searcher.search_batch(
+            queries=[row["query"] for row in batch], tops=args.tops
+        )
+        return [
+            {**row, "results": [document_to_dict(doc) for doc in documents]}
+            for row, documents in zip(batch, results)
+        ]
+
+    return run_batches(
+        batches=batched(read_queries(args.input, args.input_format), args.batch_size),
+        func=func,
+        workers=args.workers,
+    )
+
+
+def eval_command(args: argparse.Namespace) -> Iterator[Dict]:
+    """
+    説明
+    ----------
+    各クエリの検索結果に正解の位置が含まれる順位を調べる
+    start_indexとend_indexが無い(数字でない)行は順位をNoneとする
+    """
+
+    searcher = NormalSearch.load(mode=args.mode)
+    if args.watch:
+        searcher.watch()
+    validation = Validation(mode=args.mode, search=searcher)
+
+    def func(batch: List[Dict]) -> List[Dict]:
+        results = searcher.search_batch(
+            queries=[row["query"] for row in batch], tops=args.tops
+        )
+        outputs: List[Dict] = []
+        for row, documents in zip(batch, results):
+            start_index = to_index_text(row.get("start_index"))
+            end_index = to_index_text(row.get("end_index"))
+            if start_index is None or end_index is None:
+                outputs.append({**row, "rank": None})
+                continue
+            rank, in_start, in_end = validation.ranking(
+                result=documents, start_index=start_index, end_index=end_index
+            )
+            outputs.append(
+                {
+                    **row,
+                    "rank": rank,
+                    "exist_start_index": in_start,
+                    "exist_end_index": in_end,
+                }
+            )
+        return outputs
+
+    return run_batches(
+        batches=batched(read_queries(args.input, args.input_format), args.batch_size),
+        func=func,
+        workers=args.workers,
+    )
+
+
+def answer_command(args: argparse.Namespace) -> Iterator[Dict]:
+    """
+    説明
+    ----------
+    各クエリに対して回答とエビデンスを生成する
+    """
+
+    searcher = NormalSearch.load(mode=args.mode)
+    if args.watch:
+        searcher.watch()
+    gemini = GoogleGemini(
+        structured=args.structured,
+        stream=args.stream,
+        local_evidence=args.local_evidence,
+        gate=args.gate,
+    )
+
+    def func(batch: List[Dict]) -> List[Dict]:
+        queries = [row["query"] for row in batch]
+        results_list = searcher.search_batch_with_scores(
+            queries=queries, tops=args.tops
+        )
+
+        # 弾かれた質問は生成せずに「分かりません」「なし」とする
+        answerable = [
+            i
+            for i, results in enumerate(results_list)
+            if gemini.is_answerable(results=results)
+        ]
+        answerable_queries = [queries[i] for i in answerable]
+        documents_list = [[doc for doc, _ in results_list[i]] for i in answerable]
+
+        if len(answerable) == 0:
+            generated = []
+        elif args.batched:
+            generated = gemini.batch_generation(
+                queries=answerable_queries, documents_list=documents_list
+            )
+        else:
+            generated = []
+            for query, documents in zip(answerable_queries, documents_list):
+                generation_text, evidence = gemini.generation(
+                    query=query, documents=documents
+                )
+                generated.append((generation_text.content, evidence.content))
+
+        results = [("", "")] * len(batch)
+        for i, answer in zip(answerable, generated):
+            results[i] = answer
+
+        return [
+            {
+                **row,
+                "answer": gemini.normalize(generation, "分かりません"),
+                "evidence": gemini.normalize(evidence, "なし"),
+            }
+            for row, (generation, evidence) in zip(batch, results)
+        ]
+
+    return run_batches(
+        batches=batched(read_queries(args.input, args.input_format), args.batch_size),
+        func=func,
+        workers=args.workers,
+    )
+
+
+def make_parser() -> argparse.ArgumentParser:
+    """
+    説明
+    ----------
+    コマンドライン引数のパーサーを作成する
+
+    Returns
+    ----------
+    argparse.ArgumentParser
+        パーサー
+    """
+
+    parser = argparse.ArgumentParser(prog="rag-1")
+    parser.add_argument("--root", default=".", help="datasetとvectorstoreがあるディレクトリ")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="ベクトルストアを作成して保存する")
+    build_parser.add_argument("--mode", default="valid", choices=["valid", "test"])
+    build_parser.set_defaults(func=build_command)
+
+    catalog_parser = subparsers.add_parser("catalog", help="チャンクの一覧をcsv,xlsxファイルに書き出す")
+    catalog_parser.add_argument("--mode", default="valid", choices=["valid", "test"])
+    catalog_parser.add_argument(
+        "--formats", nargs="+", default=["csv", "xlsx"], choices=["csv", "xlsx"]
+    )
+    catalog_parser.set_defaults(func=catalog_command)
+
+    for name, func, tops, description in [
+        ("search", search_command, 10, "関連するドキュメントを検索する"),
+        ("eval", eval_command, 10, "検索結果の順位を調べる"),
+        ("answer", answer_command, 2, "回答とエビデンスを生成する"),
+    ]:
+        sub_parser = subparsers.add_parser(name, help=description)
+        sub_parser.add_argument("--mode", default="valid", choices=["valid", "test"])
+        sub_parser.add_argument(
+            "--input",
+            type=argparse.FileType("r", encoding="utf-8"),
+            default=sys.stdin,
+            help="クエリのJSONLまたはCSV(省略時は標準入力)",
+        )
+        sub_parser.add_argument(
+            "--format",
+            dest="input_format",
+            choices=["jsonl", "csv"],
+            default=None,
+            help="入力の形式(省略時は拡張子から判定し、標準入力はjsonl)",
+        )
+        sub_parser.add_argument("--tops", type=int, default=tops)
+        sub_parser.add_argument("--batch-size", type=int, default=16)
+        sub_parser.add_argument("--workers", type=int, default=2)
+        sub_parser.add_argument(
+            "--watch",
+            action="store_true",
+            help="新しいインデックスが保存されたら処理を止めずに切り替える",
+        )
+        sub_parser.set_defaults(func=func)
+
+    answer_parser = subparsers.choices["answer"]
+    answer_parser.add_argument(
+        "--batched", action="store_true", help="バッチ内の質問を1リクエストにまとめる"
+    )
+    answer_parser.add_argument(
+        "--structured", action="store_true", help="回答とエビデンスを1回の呼び出しで生成する"
+    )
+    answer_parser.add_argument(
+        "--stream", action="store_true", help="ストリーミングで生成し48文字で打ち切る"
+    )
+    answer_parser.add_argument(
+        "--gate",
+        action="store_true",
+        help="検索結果の類似度が閾値未満の質問はllmを呼ばずに「分かりません」とする",
+    )
+    answer_parser.add_argument(
+        "--local-evidence",
+        action="store_true",
+        help="エビデンスをllmを使わずにエンベディングモデルで抜き出す",
+    )
+
+    return parser
+
+
+def main() -> None:
+    """
+    説明
+    ----------
+    rag-1コマンドのエントリーポイント
+    結果は終わったものから1行ずつJSONLで標準出力に書き出す
+    """
+
+    args = make_parser().parse_args()
+
+    if getattr(args, "input_format", None) is None and hasattr(args, "input"):
+        args.input_format = "csv" if args.input.name.endswith(".csv") else "jsonl"
+
+    os.chdir(args.root)
+
+    for result in args.func(args):
+        sys.stdout.write(json.dumps(result, ensure_ascii=False, default=str) + "\n")
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
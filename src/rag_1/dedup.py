@@ -0,0 +1,149 @@
+import zlib
+from collections import defaultdict
+from typing import DefaultDict, List, Optional, Tuple
+
+import numpy as np
+
+# MinHashのハッシュ関数に使う素数(2^31 - 1)
+MERSENNE_PRIME = (1 << 31) - 1
+
+
+class MinHashDeduplicator:
+    """
+    Attributes
+    ----------
+    self.num_perm : int
+        MinHashの署名の長さ(ハッシュ関数の数)
+
+    self.bands : int
+        LSHのバンド数(num_permを割り切る数)
+
+    self.shingle_size : int
+        シングルの文字数
+
+    self.threshold : float
+        重複とみなす推定Jaccard係数の下限
+
+    method
+    ----------
+    signature(self, text: str) -> np.ndarray
+        文章のMinHash署名を計算するメソッド
+
+    add(self, text: str) -> Optional[int]
+        文章を登録し、重複していれば代表の番号を返すメソッド
+    """
+
+    def __init__(
+        self,
+        num_perm: int = 64,
+        bands: int = 16,
+        shingle_size: int = 5,
+        threshold: float = 0.8,
+        seed: int = 0,
+    ) -> None:
+        """
+        説明
+        ----------
+        文字シングルのMinHash署名とLSHのバンディングで
+        ほぼ同じ文章(チャンク)を見つけるクラス
+
+        Parameters
+        ----------
+        num_perm : int = 64
+            MinHashの署名の長さ(ハッシュ関数の数)
+        bands : int = 16
+            LSHのバンド数(num_permを割り切る数)
+        shingle_size : int = 5
+            シングルの文字数
+        threshold : float = 0.8
+            重複とみなす推定Jaccard係数の下限
+        seed : int = 0
+            ハッシュ関数の係数を決める乱数のシード
+        """
+
+        if num_perm % bands != 0:
+            raise ValueError(f"num_permはbandsで割り切れる必要があります: {num_perm}, {bands}")
+
+        self.num_perm = num_perm
+        self.bands = bands
+        self.shingle_size = shingle_size
+        self.threshold = threshold
+
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+
+        self._signatures: List[np.ndarray] = []
+        self._buckets: DefaultDict[Tuple[int, bytes], List[int]] = defaultdict(list)
+
+    def signature(self, text: str) -> np.ndarray:
+        """
+        説明
+        ----------
+        文章の文字シングルからMinHash署名を計算するメソッド
+
+        Parameters
+        ----------
+        text : str
+            文章
+
+        Returns
+        ----------
+        np.ndarray
+            MinHash署名(num_perm個)
+        """
+
+        size = self.shingle_size
+        shingles = {text[i : i + size] for i in range(max(len(text) - size + 1, 1))}
+        hashes = np.array(
+            [zlib.crc32(shingle.encode("utf-8")) for shingle in shingles],
+            dtype=np.uint64,
+        )
+
+        # (a * x + b) mod p を全てのハッシュ関数とシングルについて計算し、最小値を取る
+        values = (np.outer(hashes, self._a) + self._b) % MERSENNE_PRIME
+
+        return values.min(axis=0)
+
+    def add(self, text: str) -> Optional[int]:
+        """
+        説明
+        ----------
+        文章を登録するメソッド
+        同じバンドを持つ登録済みの文章と推定Jaccard係数がthreshold以上であれば
+        重複とみなして登録せず、その文章の番号を返す
+
+        Parameters
+        ----------
+        text : str
+            文章
+
+        Returns
+        ----------
+        Optional[int]
+            重複した登録済みの文章の番号(重複していなければNoneを返して登録する)
+        """
+
+        signature = self.signature(text=text)
+        rows = self.num_perm // self.bands
+        keys = [
+            (band, signature[band * rows : (band + 1) * rows].tobytes())
+            for band in range(self.bands)
+        ]
+
+        checked = set()
+        for key in keys:
+            for candidate in self._buckets.get(key, []):
+                if candidate in checked:
+                    continue
+                checked.add(candidate)
+                similarity = np.mean(signature == self._signatures[candidate])
+                if similarity >= self.threshold:
+                    return candidate
+
+        id = len(self._signatures)
+        self._signatures.append(signature)
+        for key in keys:
+            self._buckets[key].append(id)
+
+        return None
@@ -0,0 +1,149 @@
+import re
+from typing import List
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_huggingface import HuggingFaceEmbeddings
+
+from rag_1.utils import MAX_ANSWER_LENGTH
+
+
+class EvidenceExtractor:
+    """
+    Attributes
+    ----------
+    self.embedding : HuggingFaceEmbeddings
+        エンベディングモデル
+
+    self.answer_weight : float
+        回答との類似度の重み
+
+    method
+    ----------
+    split_sentences(self, text: str) -> List[str]
+        文章を文に分割するメソッド
+
+    extract(self, query: str, answer: str, documents: List[Document]) -> str
+        検索されたドキュメントからエビデンスとなる文を抜き出すメソッド
+    """
+
+    def __init__(
+        self, embedding: HuggingFaceEmbeddings, answer_weight: float = 0.5
+    ) -> None:
+        """
+        説明
+        ----------
+        llmを使わずに、エンベディングモデルでエビデンスを抜き出すクラス
+        ドキュメントを文に分割し、クエリと回答に最も近い文を選ぶ
+
+        Parameters
+        ----------
+        embedding : HuggingFaceEmbeddings
+            エンベディングモデル(検索で読み込み済みのものを使う)
+        answer_weight : float = 0.5
+            回答との類似度の重み(クエリとの類似度の重みは1)
+        """
+
+        self.embedding = embedding
+        self.answer_weight = answer_weight
+
+    def split_sentences(self, text: str) -> List[str]:
+        """
+        説明
+        ----------
+        文章を「。」「！」「？」で文に分割するメソッド
+
+        Parameters
+        ----------
+        text : str
+            文章
+
+        Returns
+        ----------
+        List[str]
+            文のリスト(区切り文字は文に含める)
+        """
+
+        sentences = re.findall(r"[^。！？]+[。！？]*", text)
+
+        return [sentence.strip() for sentence in sentences if sentence.strip()]
+
+    def extract(self, query: str, answer: str, documents: List[Document]) -> str:
+        """
+        説明
+        ----------
+        検索されたドキュメントからエビデンスとなる文を抜き出すメソッド
+        文とクエリ・回答をまとめてエンベディングし、コサイン類似度の重み付き和が
+        最も大きい文を提出できる文字数に切り詰めて返す
+
+        Parameters
+        ----------
+        query : str
+            クエリ
+        answer : str
+            生成された回答
+        documents : List[Document]
+            検索されたドキュメント
+
+        Returns
+        ----------
+        str
+            エビデンス(文が1つもない場合は空文字)
+        """
+
+        sentences = list(
+            dict.fromkeys(
+                sentence
+                for doc in documents
+                for sentence in self.split_sentences(text=doc.page_content)
+            )
+        )
+        if len(sentences) == 0:
+            return ""
+
+        # 回答が得られなかった場合はクエリだけで選ぶ
+        use_answer = len(answer) > 0 and answer != "分かりません"
+        texts = sentences + [query] + ([answer] if use_answer else [])
+
+        vectors = np.asarray(self.embedding.embed_documents(texts), dtype=np.float32)
+        vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+        sentence_vectors = vectors[: len(sentences)]
+
+        scores = sentence_vectors @ vectors[len(sentences)]
+        if use_answer:
+            scores = scores + self.answer_weight * (sentence_vectors @ vectors[-1])
+
+        best = sentences[int(np.argmax(scores))]
+
+        return self._trim(sentence=best, answer=answer if use_answer else "")
+
+    def _trim(self, sentence: str, answer: str) -> str:
+        """
+        説明
+        ----------
+        文を提出できる文字数に切り詰めるメソッド
+        回答が文に含まれる場合はそれを含む範囲を残す
+
+        Parameters
+        ----------
+        sentence : str
+            文
+        answer : str
+            生成された回答
+
+        Returns
+        ----------
+        str
+            切り詰めた文
+        """
+
+        if len(sentence) <= MAX_ANSWER_LENGTH:
+            return sentence
+
+        start = 0
+        if len(answer) > 0 and answer in sentence:
+            margin = max(MAX_ANSWER_LENGTH - len(answer), 0) // 2
+            start = max(sentence.index(answer) - margin, 0)
+            start = min(start, len(sentence) - MAX_ANSWER_LENGTH)
+
+        return sentence[start : start + MAX_ANSWER_LENGTH]
@@ -0,0 +1,204 @@
+import json
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from rag_1.search import NormalSearch
+from rag_1.utils import CONFIG
+
+
+class RetrievalGate:
+    """
+    Attributes
+    ----------
+    self.min_score : Optional[float]
+        1位のドキュメントの類似度の下限(Noneの場合は使わない)
+
+    self.min_margin : Optional[float]
+        1位と2位の類似度の差の下限(Noneの場合は使わない)
+
+    method
+    ----------
+    from_config(cls) -> RetrievalGate
+        config.jsonの閾値でインスタンスを作成するメソッド
+
+    similarities(scores: List[float]) -> List[float]
+        FAISSのスコア(L2距離)をコサイン類似度に変換するメソッド
+
+    is_answerable(self, scores: List[float]) -> bool
+        検索結果から回答できそうかどうかを判定するメソッド
+    """
+
+    def __init__(
+        self, min_score: Optional[float] = None, min_margin: Optional[float] = None
+    ) -> None:
+        """
+        説明
+        ----------
+        検索結果の類似度が低いクエリをllmに渡さずに弾くクラス
+
+        Parameters
+        ----------
+        min_score : Optional[float] = None
+            1位のドキュメントの類似度の下限(Noneの場合は使わない)
+        min_margin : Optional[float] = None
+            1位と2位の類似度の差の下限(Noneの場合は使わない)
+        """
+
+        self.min_score = min_score
+        self.min_margin = min_margin
+
+    @classmethod
+    def from_config(cls):
+        """
+        説明
+        ----------
+        config.jsonのRetrievalGateの閾値でインスタンスを作成するメソッド
+
+        Returns
+        ----------
+        RetrievalGate
+            RetrievalGateのインスタンス
+        """
+
+        config = CONFIG["RetrievalGate"]
+
+        return cls(min_score=config["min_score"], min_margin=config["min_margin"])
+
+    @staticmethod
+    def similarities(scores: List[float]) -> List[float]:
+        """
+        説明
+        ----------
+        FAISSのスコア(2乗L2距離)をコサイン類似度に変換するメソッド
+        multilingual-e5の埋め込みは正規化されているので 1 - 距離 / 2 で求まる
+
+        Parameters
+        ----------
+        scores : List[float]
+            FAISSのスコア(スコア順)
+
+        Returns
+        ----------
+        List[float]
+            コサイン類似度
+        """
+
+        return [1 - score / 2 for score in scores]
+
+    def is_answerable(self, scores: List[float]) -> bool:
+        """
+        説明
+        ----------
+        検索結果から回答できそうかどうかを判定するメソッド
+
+        Parameters
+        ----------
+        scores : List[float]
+            検索結果のFAISSのスコア(スコア順)
+
+        Returns
+        ----------
+        bool
+            閾値を満たしていればTrue(閾値が両方Noneの場合は常にTrue)
+        """
+
+        similarities = self.similarities(scores=scores)
+
+        # 閾値を設定していない場合は検索結果に関係なく全て通す
+        if self.min_score is None and self.min_margin is None:
+            return True
+        if len(similarities) == 0:
+            return False
+        if self.min_score is not None and similarities[0] < self.min_score:
+            return False
+        if (
+            self.min_margin is not None
+            and len(similarities) > 1
+            and similarities[0] - similarities[1] < self.min_margin
+        ):
+            return False
+
+        return True
+
+
+def tune(tops: int = 2, min_recall: float = 0.95) -> Dict:
+    """
+    説明
+    ----------
+    dataset/validation/ans_txt.xlsxで閾値を調整する関数
+    start_indexがある行を回答できる質問とし、その再現率がmin_recall以上のまま
+    回答できない質問を最も多く弾ける閾値の組み合わせを探す
+
+    Parameter
+    ----------
+    tops : int = 2
+        検索上位の何個を使うか(生成時と揃える)
+    min_recall : float = 0.95
+        回答できる質問を通す割合の下限
+
+    Returns
+    ----------
+    Dict
+        min_score・min_margin・回答できる質問の再現率・回答できない質問を弾いた割合
+    """
+
+    searcher = NormalSearch.load(mode="valid")
+    df = pd.read_excel("dataset/validation/ans_txt.xlsx")
+
+    answerable = df["start_index"].notna().to_numpy()
+    results = searcher.search_batch_with_scores(
+        queries=df["problem"].tolist(), tops=tops
+    )
+
+    top_scores = []
+    margins = []
+    for hits in results:
+        similarities = RetrievalGate.similarities(scores=[score for _, score in hits])
+        # 検索結果が足りない場合はis_answerableと同じく、無いものは判定に使わない
+        top_scores.append(similarities[0] if len(similarities) > 0 else -np.inf)
+        margins.append(
+            similarities[0] - similarities[1] if len(similarities) > 1 else np.inf
+        )
+    top_scores = np.array(top_scores)
+    margins = np.array(margins)
+    has_hits = np.array([len(hits) > 0 for hits in results], dtype=bool)
+
+    # 閾値の候補は回答できる質問の値(それより少しでも大きいとその質問を弾く)
+    score_candidates = [None] + sorted(
+        set(top_scores[answerable & np.isfinite(top_scores)].tolist())
+    )
+    margin_candidates = [None] + sorted(
+        set(margins[answerable & np.isfinite(margins)].tolist())
+    )
+
+    best = {"min_score": None, "min_margin": None, "recall": 1.0, "rejected": 0.0}
+
+    for min_score in score_candidates:
+        for min_margin in margin_candidates:
+            passed = np.ones(len(df), dtype=bool)
+            if min_score is not None or min_margin is not None:
+                passed &= has_hits
+            if min_score is not None:
+                passed &= top_scores >= min_score
+            if min_margin is not None:
+                passed &= margins >= min_margin
+
+            recall = passed[answerable].mean() if answerable.any() else 1.0
+            rejected = (~passed[~answerable]).mean() if (~answerable).any() else 0.0
+            if recall >= min_recall and rejected > best["rejected"]:
+                best = {
+                    "min_score": min_score,
+                    "min_margin": min_margin,
+                    "recall": float(recall),
+                    "rejected": float(rejected),
+                }
+
+    return best
+
+
+if __name__ == "__main__":
+    config = CONFIG["RetrievalGate"]
+    result = tune(tops=config["tops"], min_recall=config["min_recall"])
+    print(json.dumps(result, ensure_ascii=False, indent=4))
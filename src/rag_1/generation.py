@@ -1,17 +1,24 @@
 import csv
+import json
+import logging
 import os
 import time
+from contextlib import closing
 from pathlib import Path
-from typing import List
+from typing import Dict, List, Optional, Tuple
 
 import pandas as pd
 from dotenv import load_dotenv
 from langchain_core.documents import Document
-from langchain_core.messages import BaseMessage
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.runnables import Runnable
 from langchain_google_genai import ChatGoogleGenerativeAI
 
+from rag_1.evidence import EvidenceExtractor
+from rag_1.gate import RetrievalGate
+from rag_1.registry import REGISTRY
 from rag_1.search import NormalSearch
-from rag_1.utils import CONFIG
+from rag_1.utils import CONFIG, MAX_ANSWER_LENGTH
 
 # .envファイルを読み込み
 load_dotenv()
@@ -19,6 +26,27 @@ load_dotenv()
 # AIP Keyの取得
 API_KEY = os.getenv("API_KEY")
 
+# 回答とエビデンスのJSONの形式(OpenAPIのスキーマのサブセット)
+STRUCTURED_RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {"answer": {"type": "STRING"}, "evidence": {"type": "STRING"}},
+    "required": ["answer", "evidence"],
+}
+
+# バッチモードのJSONの形式(質問番号ごとの回答とエビデンスの配列)
+BATCH_RESPONSE_SCHEMA = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": {
+            "id": {"type": "INTEGER"},
+            "answer": {"type": "STRING"},
+            "evidence": {"type": "STRING"},
+        },
+        "required": ["id", "answer", "evidence"],
+    },
+}
+
 
 class GoogleGemini:
     """
@@ -27,28 +55,115 @@ class GoogleGemini:
     self.max_tokens : int
         最大出力トークン数
 
+    self.batch_size : int
+        バッチモードで1リクエストにまとめる質問数
+
+    self.structured : bool
+        回答とエビデンスを1回の呼び出しでまとめて生成するかどうか
+
+    self.stream : bool
+        ストリーミングで生成し、提出できる文字数に達した時点で打ち切るかどうか
+
+    self.evidence_extractor : Optional[EvidenceExtractor]
+        エビデンスをllmを使わずに抜き出すクラス(llmで生成する場合はNone)
+
+    self.gate : Optional[RetrievalGate]
+        検索結果の類似度が低いクエリを弾くクラス(弾かない場合はNone)
+
     self.llm : ChatGoogleGenerativeAI
         生成モデル
 
+    self.batch_llm : Runnable
+        バッチモード用の生成モデル(BATCH_RESPONSE_SCHEMAのJSONで出力する)
+
+    self.structured_llm : Runnable
+        回答とエビデンスをまとめて生成する用の生成モデル(STRUCTURED_RESPONSE_SCHEMAのJSONで出力する)
+
     method
     ----------
     generation(self, query: str, documents: List[Document]) -> BaseMessage
         プロンプトから回答を生成するメソッド
 
+    batch_generation(self, queries: List[str], documents_list: List[List[Document]]) -> List[Tuple[str, str]]
+        複数の質問をまとめて1リクエストで回答を生成するメソッド
+
     make_prompt(self, query: str, documents: List[Document]) -> str
         クエリと検索したドキュメントに対してプロンプトを作成するメソッド
+
+    make_batch_prompt(self, queries: List[str], documents_list: List[List[Document]]) -> str
+        複数のクエリとドキュメントをまとめたプロンプトを作成するメソッド
+
+    make_structured_prompt(self, query: str, documents: List[Document]) -> str
+        回答とエビデンスをまとめて出力させるプロンプトを作成するメソッド
+
+    normalize(self, text: str, fallback: str) -> str
+        生成された文を提出できる形に整形するメソッド
     """
 
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        structured: bool = False,
+        stream: bool = False,
+        local_evidence: bool = False,
+        gate: bool = False,
+    ) -> None:
         """
         説明
         ----------
         プロンプトを基に回答を生成するクラス
+
+        Parameters
+        ----------
+        structured : bool = False
+            回答とエビデンスを1回の呼び出しでまとめて生成するかどうか
+        stream : bool = False
+            ストリーミングで生成し、提出できる文字数に達した時点で打ち切るかどうか
+            structuredと両方Trueの場合はstructuredを優先する
+        local_evidence : bool = False
+            エビデンスをllmで生成せず、検索で読み込み済みのエンベディングモデルで抜き出すかどうか
+            structuredと両方Trueの場合はstructuredを優先する
+        gate : bool = False
+            検索結果の類似度が閾値未満のクエリはllmを呼ばずに「分かりません」「なし」とするかどうか
         """
 
-        self.max_tokens = 50
+        # ハイパーパラメータの取得
+        config = CONFIG["GoogleGemini"]
+
+        self.max_tokens = config["max_output_tokens"]
+        self.batch_size = config["batch_size"]
+        self.structured = structured
+        self.stream = stream
+        self.gate = RetrievalGate.from_config() if gate else None
+        self.evidence_extractor = None
+        if local_evidence:
+            self.evidence_extractor = EvidenceExtractor(
+                embedding=REGISTRY.embedding(),
+                answer_weight=config["evidence_answer_weight"],
+            )
         self.llm = ChatGoogleGenerativeAI(
-            model="gemini-1.5-flash", api_key=API_KEY, max_output_tokens=self.max_tokens
+            model=config["model"], api_key=API_KEY, max_output_tokens=self.max_tokens
+        )
+        # 回答とエビデンスの2つ分にJSONの記号分の余裕を持たせる
+        # ChatGoogleGenerativeAIの引数ではJSONの形式を指定できないのでgeneration_configで渡す
+        self.batch_llm = ChatGoogleGenerativeAI(
+            model=config["model"],
+            api_key=API_KEY,
+            max_output_tokens=self.max_tokens * 3 * self.batch_size,
+        ).bind(
+            generation_config={
+                "response_mime_type": "application/json",
+                "response_schema": BATCH_RESPONSE_SCHEMA,
+            }
+        )
+        self.structured_llm = ChatGoogleGenerativeAI(
+            model=config["model"],
+            api_key=API_KEY,
+            max_output_tokens=self.max_tokens * 3,
+        ).bind(
+            generation_config={
+                "response_mime_type": "application/json",
+                "response_schema": STRUCTURED_RESPONSE_SCHEMA,
+            }
         )
 
     def generation(self, query: str, documents: List[Document]) -> BaseMessage:
@@ -56,6 +171,8 @@ class GoogleGemini:
         説明
         ----------
         回答を生成するメソッド
+        structuredがTrueの場合は回答とエビデンスを1回の呼び出しで生成する
+        local_evidenceがTrueの場合はエビデンスをドキュメントから直接抜き出す
 
         Parameters
         ----------
@@ -70,13 +187,233 @@ class GoogleGemini:
             llmから生成された物
         """
 
+        if self.structured:
+            return self._structured_generation(query=query, documents=documents)
+
         prompt = self.make_prompt(query=query, documents=documents)
         evidence_prompt = self.make_evidence_prompt(query=query, documents=documents)
+
+        if self.evidence_extractor is not None:
+            if self.stream:
+                response = AIMessage(content=self._stream_generation(prompt=prompt))
+            else:
+                response = self.llm.invoke(prompt)
+            evidence = self.evidence_extractor.extract(
+                query=query,
+                answer=self._remove_whitespace(response.content),
+                documents=documents,
+            )
+            return response, AIMessage(content=evidence)
+
+        if self.stream:
+            response = AIMessage(content=self._stream_generation(prompt=prompt))
+            evidence = AIMessage(
+                content=self._stream_generation(prompt=evidence_prompt)
+            )
+            return response, evidence
+
         response = self.llm.invoke(prompt)
         evidence_prompt = self.llm.invoke(evidence_prompt)
 
         return response, evidence_prompt
 
+    def _stream_generation(self, prompt: str) -> str:
+        """
+        説明
+        ----------
+        ストリーミングで生成しながら空白と改行を取り除き、
+        提出できる文字数に達した時点でリクエストを打ち切るメソッド
+
+        Parameters
+        ----------
+        prompt : str
+            プロンプト
+
+        Returns
+        ----------
+        str
+            整形済みの生成された文(生成が空の場合は空文字)
+        """
+
+        text = ""
+
+        # ループを抜けた時点でストリームを閉じ、残りの生成を打ち切る
+        with closing(self.llm.stream(prompt)) as stream:
+            for chunk in stream:
+                text += self._remove_whitespace(chunk.content)
+                if len(text) >= MAX_ANSWER_LENGTH:
+                    break
+
+        return text[:MAX_ANSWER_LENGTH]
+
+    def _structured_generation(
+        self, query: str, documents: List[Document]
+    ) -> Tuple[BaseMessage, BaseMessage]:
+        """
+        説明
+        ----------
+        回答とエビデンスをJSONで1回の呼び出しで生成するメソッド
+        空の項目や解析できなかった場合は「分かりません」「なし」とする
+
+        Parameters
+        ----------
+        query : str
+            クエリ
+        documents : List[Document]
+            検索されたドキュメント
+
+        Returns
+        ----------
+        BaseMessage
+            回答
+        BaseMessage
+            エビデンス
+        """
+
+        prompt = self.make_structured_prompt(query=query, documents=documents)
+        response = self.structured_llm.invoke(prompt)
+
+        try:
+            data = json.loads(response.content)
+        except json.JSONDecodeError:
+            logging.info("回答とエビデンスの解析に失敗しました")
+            data = {}
+        if not isinstance(data, dict):
+            data = {}
+
+        answer = data.get("answer")
+        evidence = data.get("evidence")
+        if not isinstance(answer, str) or len(answer) == 0:
+            answer = "分かりません"
+        if not isinstance(evidence, str) or len(evidence) == 0:
+            evidence = "なし"
+
+        return AIMessage(content=answer), AIMessage(content=evidence)
+
+    def batch_generation(
+        self, queries: List[str], documents_list: List[List[Document]]
+    ) -> List[Tuple[str, str]]:
+        """
+        説明
+        ----------
+        複数の質問をまとめて回答とエビデンスを生成するメソッド
+        batch_llmの出力トークン数はbatch_size問分なので、batch_size問ずつリクエストする
+
+        Parameters
+        ----------
+        queries : List[str]
+            クエリのリスト
+        documents_list : List[List[Document]]
+            各クエリに対して検索されたドキュメント
+
+        Returns
+        ----------
+        List[Tuple[str, str]]
+            各クエリの(回答, エビデンス)
+        """
+
+        results = []
+
+        for start in range(0, len(queries), self.batch_size):
+            results.extend(
+                self._batch_request(
+                    queries=queries[start : start + self.batch_size],
+                    documents_list=documents_list[start : start + self.batch_size],
+                )
+            )
+
+        return results
+
+    def _batch_request(
+        self, queries: List[str], documents_list: List[List[Document]]
+    ) -> List[Tuple[str, str]]:
+        """
+        説明
+        ----------
+        batch_size問以下の質問を1リクエストで回答とエビデンスを生成するメソッド
+        JSONとして解析できなかった質問はgenerationで個別に生成し直す
+
+        Parameters
+        ----------
+        queries : List[str]
+            クエリのリスト(batch_size問以下)
+        documents_list : List[List[Document]]
+            各クエリに対して検索されたドキュメント
+
+        Returns
+        ----------
+        List[Tuple[str, str]]
+            各クエリの(回答, エビデンス)
+        """
+
+        prompt = self.make_batch_prompt(queries=queries, documents_list=documents_list)
+        response = self.batch_llm.invoke(prompt)
+        answers = self._parse_batch_response(
+            content=response.content, size=len(queries)
+        )
+
+        results = []
+
+        for i, (query, documents) in enumerate(zip(queries, documents_list), start=1):
+            if i in answers:
+                results.append(answers[i])
+            else:
+                logging.info(f"質問{i}の解析に失敗したため個別に生成します")
+                generation_text, evidence = self.generation(
+                    query=query, documents=documents
+                )
+                results.append((generation_text.content, evidence.content))
+
+        return results
+
+    def _parse_batch_response(
+        self, content: str, size: int
+    ) -> Dict[int, Tuple[str, str]]:
+        """
+        説明
+        ----------
+        バッチモードのJSONの出力を質問ごとの回答に分割するメソッド
+        形式が正しくない要素は含めない
+
+        Parameters
+        ----------
+        content : str
+            llmから生成されたJSON文字列
+        size : int
+            リクエストに含めた質問数
+
+        Returns
+        ----------
+        Dict[int, Tuple[str, str]]
+            質問番号(1始まり)と(回答, エビデンス)の対応
+        """
+
+        try:
+            data = json.loads(content)
+        except json.JSONDecodeError:
+            return {}
+
+        if isinstance(data, dict):
+            data = [data]
+        if not isinstance(data, list):
+            return {}
+
+        answers = {}
+
+        for item in data:
+            if not isinstance(item, dict):
+                continue
+            id = item.get("id")
+            answer = item.get("answer")
+            evidence = item.get("evidence")
+            if type(id) != int or not 1 <= id <= size:
+                continue
+            if not isinstance(answer, str) or not isinstance(evidence, str):
+                continue
+            answers[id] = (answer, evidence)
+
+        return answers
+
     def make_evidence_prompt(self, query: str, documents: List[Document]) -> str:
         """
         説明
@@ -129,11 +466,152 @@ class GoogleGemini:
 
         return prompt
 
-    def test(self) -> None:
+    def make_structured_prompt(self, query: str, documents: List[Document]) -> str:
+        """
+        説明
+        ----------
+        回答とエビデンスをまとめてJSONで出力させるプロンプトを作成するメソッド
+
+        Parameters
+        ----------
+        query : str
+            クエリ
+        documents : List[Document]
+            検索されたドキュメント
+
+        Returns
+        ----------
+        str
+            作成したプロンプト
+        """
+
+        documents_list = [doc.page_content for doc in documents]
+        documents_text = "\n".join(documents_list)
+
+        prompt = (
+            f"ドキュメント： \n\n{documents_text}\n\n"
+            f"上のドキュメントを基に質問「{query}」に端的に予測回答し、回答の証拠となる情報をドキュメントから抜き出してください。"
+            "もし予測できない場合の回答は「分かりません」、証拠がない場合は「なし」として下さい。"
+            '出力は{"answer": 回答, "evidence": 証拠}の形式のJSONとして下さい。'
+        )
+
+        return prompt
+
+    def make_batch_prompt(
+        self, queries: List[str], documents_list: List[List[Document]]
+    ) -> str:
+        """
+        説明
+        ----------
+        複数の質問をまとめたプロンプトを作成するメソッド
+
+        Parameters
+        ----------
+        queries : List[str]
+            クエリのリスト
+        documents_list : List[List[Document]]
+            各クエリに対して検索されたドキュメント
+
+        Returns
+        ----------
+        str
+            作成したプロンプト
+        """
+
+        question_list = []
+
+        for i, (query, documents) in enumerate(zip(queries, documents_list), start=1):
+            documents_text = "\n".join([doc.page_content for doc in documents])
+            question_list.append(f"### 質問{i}\nドキュメント： \n{documents_text}\n質問： {query}")
+        questions_text = "\n\n".join(question_list)
+
+        prompt = (
+            "以下の各質問について、その質問のドキュメントだけを基に端的に予測回答し、回答の証拠となる情報をドキュメントから抜き出してください。"
+            "もし予測できない場合の回答は「分かりません」、証拠がない場合は「なし」として下さい。\n"
+            '出力は[{"id": 質問番号, "answer": 回答, "evidence": 証拠}]の形式のJSON配列として下さい。'
+            f"\n\n{questions_text}"
+        )
+
+        return prompt
+
+    def normalize(self, text: str, fallback: str) -> str:
+        """
+        説明
+        ----------
+        生成された文から空白と改行を取り除き、提出できる文字数に切り詰めるメソッド
+
+        Parameters
+        ----------
+        text : str
+            生成された文
+        fallback : str
+            生成された文が空だった場合に返す文
+
+        Returns
+        ----------
+        str
+            整形した文
+        """
+
+        if len(text) == 0:
+            return fallback
+
+        text = self._remove_whitespace(text)
+
+        return text[:MAX_ANSWER_LENGTH]
+
+    def is_answerable(self, results: List[Tuple[Document, float]]) -> bool:
+        """
+        説明
+        ----------
+        検索結果の類似度から生成するかどうかを判定するメソッド
+        gateを使わない場合は常にTrue
+
+        Parameters
+        ----------
+        results : List[Tuple[Document, float]]
+            検索されたドキュメントとスコア
+
+        Returns
+        ----------
+        bool
+            生成する場合はTrue
+        """
+
+        if self.gate is None:
+            return True
+
+        return self.gate.is_answerable(scores=[score for _, score in results])
+
+    def _remove_whitespace(self, text: str) -> str:
+        """
+        説明
+        ----------
+        改行、全角スペース、半角スペースを取り除くメソッド
+
+        Parameters
+        ----------
+        text : str
+            文
+
+        Returns
+        ----------
+        str
+            空白を取り除いた文
+        """
+
+        return text.replace("\n", "").replace("\u3000", "").replace(" ", "")
+
+    def test(self, batched: bool = False) -> None:
         """
         説明
         ----------
         query.csvの質問文に対して回答を生成させる。
+
+        Parameters
+        ----------
+        batched : bool = False
+            複数の質問をまとめて1リクエストで生成するかどうか
         """
 
         searcher = NormalSearch.load(mode="test")
@@ -143,39 +621,63 @@ class GoogleGemini:
         generation_list = []
         evidence_list = []
 
-        for row in df.itertuples():
-            query = row.problem
-
-            results = searcher.search(query=query, tops=2)
-
-            generation_text, evidence = self.generation(query=query, documents=results)
-
-            if len(generation_text.content) == 0:
-                generation_list.append("分かりません")
-            else:
-                generation = (
-                    generation_text.content.replace("\n", "")
-                    .replace("\u3000", "")
-                    .replace(" ", "")
+        if batched:
+            query_list = df["problem"].tolist()
+
+            for i in range(0, len(query_list), self.batch_size):
+                queries = query_list[i : i + self.batch_size]
+                results_list = [
+                    searcher.search_with_scores(query=query, tops=2)
+                    for query in queries
+                ]
+
+                # 弾かれなかった質問だけをまとめて生成する
+                answerable = [
+                    j
+                    for j, results in enumerate(results_list)
+                    if self.is_answerable(results=results)
+                ]
+                answers = [("", "")] * len(queries)
+                if len(answerable) > 0:
+                    generated = self.batch_generation(
+                        queries=[queries[j] for j in answerable],
+                        documents_list=[
+                            [doc for doc, _ in results_list[j]] for j in answerable
+                        ],
+                    )
+                    for j, answer in zip(answerable, generated):
+                        answers[j] = answer
+
+                for answer_text, evidence_text in answers:
+                    generation_list.append(self.normalize(answer_text, "分かりません"))
+                    evidence_list.append(self.normalize(evidence_text, "なし"))
+
+                if len(answerable) > 0:
+                    time.sleep(1)
+        else:
+            for row in df.itertuples():
+                query = row.problem
+
+                results_with_scores = searcher.search_with_scores(query=query, tops=2)
+
+                if not self.is_answerable(results=results_with_scores):
+                    logging.info(f"検索結果の類似度が低いため生成しません: {query}")
+                    generation_list.append("分かりません")
+                    evidence_list.append("なし")
+                    continue
+
+                results = [doc for doc, _ in results_with_scores]
+
+                generation_text, evidence = self.generation(
+                    query=query, documents=results
                 )
-                if len(generation) > 48:
-                    generation_list.append(generation[:48])
-                else:
-                    generation_list.append(generation)
-            if len(evidence.content) == 0:
-                evidence_list.append("なし")
-            else:
-                evidence = (
-                    evidence.content.replace("\n", "")
-                    .replace("\u3000", "")
-                    .replace(" ", "")
+
+                generation_list.append(
+                    self.normalize(generation_text.content, "分かりません")
                 )
-                if len(evidence) > 48:
-                    evidence_list.append(evidence[:48])
-                else:
-                    evidence_list.append(evidence)
+                evidence_list.append(self.normalize(evidence.content, "なし"))
 
-            time.sleep(1)
+                time.sleep(1)
 
         chunk_size = CONFIG["RecursiveCharacterTextSplitter"]["chunk_size"]
         chunk_overlap = CONFIG["RecursiveCharacterTextSplitter"]["chunk_overlap"]
@@ -0,0 +1,623 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from langchain_community.vectorstores import FAISS
+from langchain_huggingface import HuggingFaceEmbeddings
+
+from rag_1.catalog import CATALOG_FILE_NAME, count_rows
+from rag_1.utils import CONFIG, get_corpus_paths, init_embedding_model
+
+
+class IndexRegistry:
+    """
+    Attributes
+    ----------
+    self.root : str
+        インデックスを保存するディレクトリ
+
+    self.capacity : int
+        メモリ上に保持するインデックスの最大数
+
+    self.keep_versions : int
+        キーごとに残すバージョンの数
+
+    self._cache : OrderedDict[str, FAISS]
+        読み込み済みのインデックス(バージョンのpathごとのLRU)
+
+    self._embeddings : Dict[str, HuggingFaceEmbeddings]
+        読み込み済みのエンベディングモデル(モデル名ごと)
+
+    self._manifests : Dict[Tuple[str, int, int], str]
+        txtファイルのハッシュ値のキャッシュ
+
+    method
+    ----------
+    identity(self, mode: str, config: Optional[Dict] = None) -> Dict
+        インデックスを識別する情報をまとめるメソッド
+
+    identity_of(self, path: str, mode: str, config: Optional[Dict] = None) -> Dict
+        保存したバージョンの作成時の識別情報を返すメソッド
+
+    key(self, mode: str, config: Optional[Dict] = None) -> str
+        コーパスと設定からインデックスのキーを作成するメソッド
+
+    key_of(self, identity: Dict) -> str
+        識別情報からインデックスのキーを作成するメソッド
+
+    path(self, key: str) -> str
+        キーに対応する保存先のpathを返すメソッド
+
+    save(self, vectorstore: FAISS, mode: str, config: Optional[Dict] = None, files: Optional[Dict[str, str]] = None, identity: Optional[Dict] = None) -> str
+        インデックスを新しいバージョンとして保存し、公開するメソッド
+
+    resolve(self, mode: str, config: Optional[Dict] = None) -> str
+        キーの現在のバージョンのpathを返すメソッド
+
+    latest(self, mode: str) -> Optional[str]
+        modeで最後に公開されたバージョンのpathを返すメソッド
+
+    load(self, mode: str, config: Optional[Dict] = None) -> FAISS
+        インデックスをキャッシュまたはディスクから読み込むメソッド
+
+    load_version(self, path: str, config: Optional[Dict] = None) -> FAISS
+        指定したバージョンのインデックスを読み込むメソッド
+
+    metadata(self, path: str) -> Dict
+        バージョンの作成時の情報を読み込むメソッド
+
+    embedding(self, config: Optional[Dict] = None) -> HuggingFaceEmbeddings
+        エンベディングモデルを読み込むメソッド
+    """
+
+    def __init__(self, root: str, capacity: int, keep_versions: int = 2) -> None:
+        """
+        説明
+        ----------
+        コーパス・チャンク分割の設定・エンベディングモデルのハッシュ値を
+        キーとしてインデックスを管理するクラス
+        インデックスは<root>/<key>/versions/<version>に保存し、
+        <root>/<key>/currentと<root>/current-<mode>のシンボリックリンクで公開する
+
+        Parameters
+        ----------
+        root : str
+            インデックスを保存するディレクトリ
+        capacity : int
+            メモリ上に保持するインデックスの最大数
+        keep_versions : int = 2
+            キーごとに残すバージョンの数(公開中のものを含む)
+        """
+
+        self.root = root
+        self.capacity = capacity
+        self.keep_versions = keep_versions
+        self._cache: "OrderedDict[str, FAISS]" = OrderedDict()
+        self._embeddings: Dict[str, HuggingFaceEmbeddings] = {}
+        self._manifests: Dict[Tuple[str, int, int], str] = {}
+        self._lock = threading.Lock()
+
+    def _manifest(self, mode: str) -> List[Dict[str, str]]:
+        """
+        説明
+        ----------
+        コーパスの各txtファイルのpathとハッシュ値の一覧を作成するメソッド
+        更新日時とサイズが変わっていなければ前回のハッシュ値を使う
+
+        Parameters
+        ----------
+        mode : str
+            検証用かテスト用か区別するためのもの
+
+        Returns
+        ----------
+        List[Dict[str, str]]
+            txtファイルのpathとハッシュ値
+        """
+
+        manifest = []
+
+        for path in get_corpus_paths(mode=mode):
+            stat = os.stat(path)
+            stat_key = (path, stat.st_mtime_ns, stat.st_size)
+            if stat_key not in self._manifests:
+                with open(path, "rb") as file:
+                    self._manifests[stat_key] = hashlib.sha256(file.read()).hexdigest()
+            manifest.append({"path": path, "sha256": self._manifests[stat_key]})
+
+        return manifest
+
+    def identity(self, mode: str, config: Optional[Dict] = None) -> Dict:
+        """
+        説明
+        ----------
+        インデックスを識別する情報をまとめるメソッド
+
+        Parameters
+        ----------
+        mode : str
+            検証用かテスト用か区別するためのもの
+        config : Optional[Dict] = None
+            使用する設定(Noneの場合はconfig.jsonの設定)
+
+        Returns
+        ----------
+        Dict
+            コーパス・チャンク分割の設定・エンベディングモデル・重複除去の設定
+        """
+
+        config = config or CONFIG
+
+        return {
+            "corpus": self._manifest(mode=mode),
+            "splitter": config["RecursiveCharacterTextSplitter"],
+            "embedding": config["HuggingFaceEmbeddings"]["model_name"],
+            "deduplication": config["Deduplication"],
+        }
+
+    def identity_of(self, path: str, mode: str, config: Optional[Dict] = None) -> Dict:
+        """
+        説明
+        ----------
+        保存したバージョンの作成時の識別情報を返すメソッド
+        metadata.jsonが無い古い形式のものは現在のコーパスと設定から作成する
+
+        Parameters
+        ----------
+        path : str
+            バージョンのpath
+        mode : str
+            検証用かテスト用か区別するためのもの
+        config : Optional[Dict] = None
+            使用する設定(Noneの場合はconfig.jsonの設定)
+
+        Returns
+        ----------
+        Dict
+            コーパス・チャンク分割の設定・エンベディングモデル・重複除去の設定
+        """
+
+        if not os.path.isfile(os.path.join(path, "metadata.json")):
+            return self.identity(mode=mode, config=config)
+
+        metadata = self.metadata(path=path)
+
+        names = ["corpus", "splitter", "embedding", "deduplication"]
+
+        return {name: metadata[name] for name in names}
+
+    def key(self, mode: str, config: Optional[Dict] = None) -> str:
+        """
+        説明
+        ----------
+        コーパスと設定からインデックスのキーを作成するメソッド
+
+        Parameters
+        ----------
+        mode : str
+            検証用かテスト用か区別するためのもの
+        config : Optional[Dict] = None
+            使用する設定(Noneの場合はconfig.jsonの設定)
+
+        Returns
+        ----------
+        str
+            インデックスのキー
+        """
+
+        return self.key_of(identity=self.identity(mode=mode, config=config))
+
+    def key_of(self, identity: Dict) -> str:
+        """
+        説明
+        ----------
+        識別情報からインデックスのキーを作成するメソッド
+
+        Parameters
+        ----------
+        identity : Dict
+            identityやidentity_ofで作成した識別情報
+
+        Returns
+        ----------
+        str
+            インデックスのキー
+        """
+
+        text = json.dumps(identity, sort_keys=True, ensure_ascii=False)
+
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+    def path(self, key: str) -> str:
+        """
+        説明
+        ----------
+        キーに対応する保存先のpathを返すメソッド
+
+        Parameters
+        ----------
+        key : str
+            インデックスのキー
+
+        Returns
+        ----------
+        str
+            保存先のpath
+        """
+
+        return os.path.join(self.root, key)
+
+    def embedding(self, config: Optional[Dict] = None) -> HuggingFaceEmbeddings:
+        """
+        説明
+        ----------
+        エンベディングモデルを読み込むメソッド
+        同じモデルは一度だけ読み込む
+
+        Parameters
+        ----------
+        config : Optional[Dict] = None
+            使用する設定(Noneの場合はconfig.jsonの設定)
+
+        Returns
+        ----------
+        HuggingFaceEmbeddings
+            エンベディングモデル
+        """
+
+        config = config or CONFIG
+        model_name = config["HuggingFaceEmbeddings"]["model_name"]
+
+        with self._lock:
+            if model_name not in self._embeddings:
+                self._embeddings[model_name] = init_embedding_model(config=config)
+
+            return self._embeddings[model_name]
+
+    def _put(self, key: str, vectorstore: FAISS) -> None:
+        """
+        説明
+        ----------
+        インデックスをキャッシュに追加し、古いものから捨てるメソッド
+
+        Parameters
+        ----------
+        key : str
+            バージョンのpath
+        vectorstore : FAISS
+            ベクトルストア
+        """
+
+        with self._lock:
+            self._cache[key] = vectorstore
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.capacity:
+                self._cache.popitem(last=False)
+
+    def _verify(
+        self,
+        path: str,
+        vectorstore: FAISS,
+        config: Optional[Dict],
+        files: Tuple[str, ...] = (),
+    ) -> None:
+        """
+        説明
+        ----------
+        保存したインデックスを読み込み直し、壊れていないか確認するメソッド
+        チャンクの一覧がある場合は行数がベクトル数と一致するかも確認する
+
+        Parameters
+        ----------
+        path : str
+            保存先のpath
+        vectorstore : FAISS
+            保存したベクトルストア
+        config : Optional[Dict]
+            使用する設定(Noneの場合はconfig.jsonの設定)
+        files : Tuple[str, ...] = ()
+            インデックスと一緒に公開するファイルの名前
+        """
+
+        for name in ["index.faiss", "index.pkl", "metadata.json", *files]:
+            if not os.path.isfile(os.path.join(path, name)):
+                raise RuntimeError(f"インデックスの保存に失敗しました({name}がありません): {path}")
+
+        loaded = FAISS.load_local(
+            folder_path=path,
+            embeddings=self.embedding(config=config),
+            allow_dangerous_deserialization=True,
+        )
+        ntotal = loaded.index.ntotal
+        if ntotal != vectorstore.index.ntotal or ntotal != len(
+            loaded.index_to_docstore_id
+        ):
+            raise RuntimeError(f"インデックスの保存に失敗しました(ベクトル数が一致しません): {path}")
+
+        if CATALOG_FILE_NAME in files and (
+            count_rows(path=os.path.join(path, CATALOG_FILE_NAME)) != ntotal
+        ):
+            raise RuntimeError(f"インデックスの保存に失敗しました(チャンクの一覧の行数が一致しません): {path}")
+
+    def _link(self, target: str, link: str) -> None:
+        """
+        説明
+        ----------
+        シンボリックリンクをアトミックに張り替えるメソッド
+        一時的な名前でリンクを作成してからrenameするので、読み込む側は
+        古いバージョンか新しいバージョンのどちらかを必ず見る
+
+        Parameters
+        ----------
+        target : str
+            リンク先(linkのディレクトリからの相対path)
+        link : str
+            シンボリックリンクのpath
+        """
+
+        temporary = f"{link}.{uuid.uuid4().hex}.tmp"
+        os.symlink(target, temporary)
+        os.replace(temporary, link)
+
+    def _prune(self, key: str) -> None:
+        """
+        説明
+        ----------
+        古いバージョンを削除するメソッド(公開中のバージョンは残す)
+
+        Parameters
+        ----------
+        key : str
+            インデックスのキー
+        """
+
+        versions_path = os.path.join(self.path(key=key), "versions")
+        current = os.path.realpath(os.path.join(self.path(key=key), "current"))
+
+        versions = sorted(os.listdir(versions_path), reverse=True)
+        for version in versions[self.keep_versions :]:
+            path = os.path.join(versions_path, version)
+            if os.path.realpath(path) != current:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def save(
+        self,
+        vectorstore: FAISS,
+        mode: str,
+        config: Optional[Dict] = None,
+        files: Optional[Dict[str, str]] = None,
+        identity: Optional[Dict] = None,
+    ) -> str:
+        """
+        説明
+        ----------
+        インデックスと作成時の情報を新しいバージョンとして保存するメソッド
+        一時ディレクトリに書き込んで読み込み直して確認してから、
+        renameとシンボリックリンクの張り替えで公開するので、
+        途中で失敗しても読み込む側が書きかけのインデックスを見ることはない
+
+        Parameters
+        ----------
+        vectorstore : FAISS
+            ベクトルストア
+        mode : str
+            検証用かテスト用か区別するためのもの
+        config : Optional[Dict] = None
+            使用する設定(Noneの場合はconfig.jsonの設定)
+        files : Optional[Dict[str, str]] = None
+            インデックスと一緒に公開するファイル(バージョン内のファイル名: コピー元のpath)
+        identity : Optional[Dict] = None
+            インデックスの作成時の識別情報(Noneの場合は現在のコーパスと設定から作成)
+            作成中にコーパスが変わっても、作成に使ったコーパスのキーで保存するために渡す
+
+        Returns
+        ----------
+        str
+            保存したバージョンのpath
+        """
+
+        if identity is None:
+            identity = self.identity(mode=mode, config=config)
+        key = self.key_of(identity=identity)
+        key_path = self.path(key=key)
+        version = datetime.now().strftime("%Y%m%d%H%M%S%f")
+
+        staging_path = os.path.join(key_path, f".staging-{uuid.uuid4().hex}")
+        os.makedirs(staging_path)
+
+        try:
+            vectorstore.save_local(folder_path=staging_path)
+            for name, source in (files or {}).items():
+                shutil.copyfile(source, os.path.join(staging_path, name))
+
+            metadata = {
+                "key": key,
+                "mode": mode,
+                "version": version,
+                "num_chunks": vectorstore.index.ntotal,
+                "created_at": datetime.now().isoformat(),
+                **identity,
+            }
+            metadata_path = os.path.join(staging_path, "metadata.json")
+            with open(metadata_path, "w", encoding="utf-8") as file:
+                json.dump(metadata, file, ensure_ascii=False, indent=4)
+
+            self._verify(
+                path=staging_path,
+                vectorstore=vectorstore,
+                config=config,
+                files=tuple(files or {}),
+            )
+
+            version_path = os.path.join(key_path, "versions", version)
+            os.makedirs(os.path.dirname(version_path), exist_ok=True)
+            os.rename(staging_path, version_path)
+        except BaseException:
+            shutil.rmtree(staging_path, ignore_errors=True)
+            raise
+
+        self._link(
+            target=os.path.join("versions", version),
+            link=os.path.join(key_path, "current"),
+        )
+        self._link(
+            target=os.path.join(key, "versions", version),
+            link=os.path.join(self.root, f"current-{mode}"),
+        )
+        self._prune(key=key)
+
+        self._put(key=os.path.realpath(version_path), vectorstore=vectorstore)
+        logging.info(f"インデックスを保存しました: {version_path}")
+
+        return os.path.realpath(version_path)
+
+    def resolve(self, mode: str, config: Optional[Dict] = None) -> str:
+        """
+        説明
+        ----------
+        キーの現在のバージョンのpathを返すメソッド
+        バージョン管理をする前の形式で保存したものはキーのディレクトリを返す
+
+        Parameters
+        ----------
+        mode : str
+            検証用かテスト用か区別するためのもの
+        config : Optional[Dict] = None
+            使用する設定(Noneの場合はconfig.jsonの設定)
+
+        Returns
+        ----------
+        str
+            バージョンのpath
+        """
+
+        key_path = self.path(key=self.key(mode=mode, config=config))
+
+        current = os.path.join(key_path, "current")
+        if os.path.exists(current):
+            return os.path.realpath(current)
+        if os.path.isfile(os.path.join(key_path, "index.faiss")):
+            return os.path.realpath(key_path)
+
+        raise FileNotFoundError(
+            f"インデックスが見つかりません。先にNormalSearchで作成して保存してください: {key_path}"
+        )
+
+    def latest(self, mode: str) -> Optional[str]:
+        """
+        説明
+        ----------
+        modeで最後に公開されたバージョンのpathを返すメソッド
+        コーパスや設定を変えて作り直した場合はキーの異なるバージョンを返す
+
+        Parameters
+        ----------
+        mode : str
+            検証用かテスト用か区別するためのもの
+
+        Returns
+        ----------
+        Optional[str]
+            バージョンのpath(まだ公開されていない場合はNone)
+        """
+
+        link = os.path.join(self.root, f"current-{mode}")
+        if not os.path.exists(link):
+            return None
+
+        return os.path.realpath(link)
+
+    def load(self, mode: str, config: Optional[Dict] = None) -> FAISS:
+        """
+        説明
+        ----------
+        キーの現在のバージョンのインデックスを読み込むメソッド
+        読み込み済みであればキャッシュから返す
+
+        Parameters
+        ----------
+        mode : str
+            検証用かテスト用か区別するためのもの
+        config : Optional[Dict] = None
+            使用する設定(Noneの場合はconfig.jsonの設定)
+
+        Returns
+        ----------
+        FAISS
+            ベクトルストア
+        """
+
+        return self.load_version(
+            path=self.resolve(mode=mode, config=config), config=config
+        )
+
+    def load_version(self, path: str, config: Optional[Dict] = None) -> FAISS:
+        """
+        説明
+        ----------
+        指定したバージョンのインデックスを読み込むメソッド
+        読み込み済みであればキャッシュから返す
+
+        Parameters
+        ----------
+        path : str
+            バージョンのpath
+        config : Optional[Dict] = None
+            使用する設定(Noneの場合はconfig.jsonの設定)
+
+        Returns
+        ----------
+        FAISS
+            ベクトルストア
+        """
+
+        path = os.path.realpath(path)
+
+        with self._lock:
+            if path in self._cache:
+                self._cache.move_to_end(path)
+                return self._cache[path]
+
+        vectorstore = FAISS.load_local(
+            folder_path=path,
+            embeddings=self.embedding(config=config),
+            allow_dangerous_deserialization=True,
+        )
+        self._put(key=path, vectorstore=vectorstore)
+        logging.info(f"インデックスを読み込みました: {path}")
+
+        return vectorstore
+
+    def metadata(self, path: str) -> Dict:
+        """
+        説明
+        ----------
+        バージョンの作成時の情報を読み込むメソッド
+
+        Parameters
+        ----------
+        path : str
+            バージョンのpath
+
+        Returns
+        ----------
+        Dict
+            metadata.jsonの内容
+        """
+
+        with open(os.path.join(path, "metadata.json"), encoding="utf-8") as file:
+            return json.load(file)
+
+
+REGISTRY = IndexRegistry(
+    root=CONFIG["IndexRegistry"]["root"],
+    capacity=CONFIG["IndexRegistry"]["capacity"],
+    keep_versions=CONFIG["IndexRegistry"]["keep_versions"],
+)
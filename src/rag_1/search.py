@@ -1,16 +1,46 @@
+import heapq
 import logging
-from typing import List
+import os
+import shutil
+import tempfile
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
 
+import faiss
+import numpy as np
 from langchain_chroma import Chroma
 from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
 from langchain_core.documents import Document
 
-from rag_1.utils import CONFIG, get_text, init_embedding_model, make_documents
+from rag_1.cache import RETRIEVAL_CACHE, RetrievalCache
+from rag_1.catalog import CATALOG_FILE_NAME, ChunkCatalogWriter, count_rows
+from rag_1.chunks import ChunkDocstore, ChunkStore
+from rag_1.dedup import MinHashDeduplicator
+from rag_1.registry import REGISTRY
+from rag_1.utils import CONFIG, batched, iter_documents
 
 # ログの基本設定
 logging.basicConfig(level=logging.INFO)
 
 
+class IndexSnapshot(NamedTuple):
+    """
+    説明
+    ----------
+    1回の検索で使うインデックス一式
+    検索の途中でインデックスが切り替わっても同じものを使い続けるためにまとめて取得する
+    """
+
+    vectorstore: FAISS
+    shards: Optional[List[Tuple[faiss.Index, List[str]]]]
+    index_key: str
+
+
 class NormalSearch:
     """
     Attributes
@@ -21,26 +51,68 @@ class NormalSearch:
     self.embedding : HuggingFaceEmbeddings
         エンベディングモデル
 
-    self.documents : Document
-        ドキュメント
-
     self.mode : str
         検証用かテスト用か区別するためのもの
 
+    self.config : Dict
+        インデックスの作成に使用した設定
+
+    self.index_key : str
+        インデックスのキー(コーパスと設定のハッシュ値)
+
+    self.identity : Optional[Dict]
+        インデックスの作成時のコーパスと設定(レジストリを経由しない場合はNone)
+
+    self.shards : Optional[List[Tuple[faiss.Index, List[str]]]]
+        分割したインデックスとその中のベクトルのドキュメントid(分割しない場合はNone)
+
+    self.version : Optional[str]
+        使用しているインデックスのバージョンのpath(保存前はNone)
+
     method
     ----------
     search(self, query: str, tops: int) -> List[Document]
         クエリに対して関連するドキュメントを探すメソッド
 
+    search_batch(self, queries: List[str], tops: int) -> List[List[Document]]
+        複数のクエリをまとめてエンベディングし、関連するドキュメントを探すメソッド
+
+    search_with_scores(self, query: str, tops: int) -> List[Tuple[Document, float]]
+        関連するドキュメントをスコアと一緒に探すメソッド
+
+    search_batch_with_scores(self, queries: List[str], tops: int) -> List[List[Tuple[Document, float]]]
+        複数のクエリに関連するドキュメントをスコアと一緒に探すメソッド
+
     load(cls: Type[NormalSearch]) -> NormalSearch
         ベクトルストアを読み込む
 
+    shard(self, n_shards: int, by: str = "range") -> None
+        インデックスを複数のシャードに分割するメソッド
+
+    swap(self, path: str) -> bool
+        別のバージョンのインデックスに切り替えるメソッド
+
+    watch(self, interval: Optional[float] = None) -> None
+        新しいバージョンが公開されたらバックグラウンドで切り替えるメソッド
+
+    unwatch(self) -> None
+        新しいバージョンの監視をやめるメソッド
+
     _setup(self) -> None
         セットアップメソッド
         外部の関数を使用している
+
+    _build(self) -> FAISS
+        チャンクをバッチごとにエンベディングしてベクトルストアに追加するメソッド
+
+    _deduplicate(self, documents: Iterator[Document], store: ChunkStore) -> Iterator[Document]
+        ほぼ同じチャンクを取り除くジェネレータ
+
+    _retrieve(self, queries: List[str], tops: int) -> List[List[Tuple[str, float]]]
+        キャッシュを使いながら各クエリの検索結果のidとスコアを求めるメソッド
     """
 
-    def __init__(self, mode: str = "valid") -> None:
+    def __init__(self, mode: str = "valid", config: Optional[Dict] = None) -> None:
         """
         説明
         ----------
@@ -50,28 +122,27 @@ class NormalSearch:
         ----------
         mode : str = "valid"
             検証用かテスト用か区別するためのもの
+        config : Optional[Dict] = None
+            使用する設定(Noneの場合はconfig.jsonの設定)
         """
 
-        chunk_size = CONFIG["RecursiveCharacterTextSplitter"]["chunk_size"]
-        chunk_overlap = CONFIG["RecursiveCharacterTextSplitter"]["chunk_overlap"]
-
-        if mode == "valid":
-            self.path = f"vectorstore/{mode}"
-        elif mode == "test":
-            self.path = (
-                f"vectorstore/{mode}/chunk_size{chunk_size}chunk_overlap{chunk_overlap}"
-            )
-        else:
-            self.path = "vectorstore/valid"
-
         self.mode = mode
+        self.config = config or CONFIG
+        # 作成中にコーパスが変わっても作成開始時のキーで保存する
+        # 未対応のmodeはここでエラーになる
+        self.identity: Optional[Dict] = REGISTRY.identity(mode=mode, config=self.config)
+        self.index_key = REGISTRY.key_of(identity=self.identity)
+        self.version: Optional[str] = None
+        self._swap_lock = threading.Lock()
+        self._watcher: Optional[Tuple[threading.Thread, threading.Event]] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_workers = 0
+        self._catalog_path: Optional[str] = None
         self._setup()
         logging.info("ベクトルストアの作成開始！")
-        self.vectorstore = FAISS.from_documents(
-            documents=self.documents,
-            embedding=self.embedding,
-        )
+        self.vectorstore = self._build()
         logging.info("ベクトルストアの作成完了！")
+        self._setup_shards()
 
     def _setup(self) -> None:
         """
@@ -80,13 +151,145 @@ class NormalSearch:
         他のpyファイルで定義した関数を使ってセットアップを行うメソッド
         """
 
-        text_list, first_line_list = get_text(mode=self.mode)
+        self.embedding = REGISTRY.embedding(config=self.config)
+
+    def _build(self) -> FAISS:
+        """
+        説明
+        ----------
+        チャンクを一定数ずつエンベディングし、ベクトルストアに追加していくメソッド
+        全チャンクとその埋め込みを同時にメモリに持たないため、
+        コーパスが大きくなってもメモリ使用量はほぼ一定になる
+
+        Returns
+        ----------
+        FAISS
+            作成したベクトルストア
+        """
+
+        batch_size = self.config["NormalSearch"]["batch_size"]
+        documents = iter_documents(mode=self.mode, config=self.config)
+        # チャンクの一覧は別スレッドでParquetファイルに書き込み、saveでバージョンと一緒に公開する
+        catalog = None
+        if self.config["ChunkCatalog"]["enabled"]:
+            directory = tempfile.mkdtemp(prefix="chunk-catalog-")
+            # 保存しないまま破棄された場合も一時ディレクトリを削除する
+            weakref.finalize(self, shutil.rmtree, directory, True)
+            catalog = ChunkCatalogWriter(
+                path=os.path.join(directory, CATALOG_FILE_NAME),
+                background=self.config["ChunkCatalog"]["background"],
+            )
+
+        # チャンクはDocumentではなく配列としてまとめて保持する
+        store = ChunkStore()
+        if self.config["Deduplication"]["enabled"]:
+            documents = self._deduplicate(documents=documents, store=store)
+
+        vectorstore = None
+        start_time = time.perf_counter()
+
+        try:
+            for i, batch in enumerate(batched(documents, batch_size), start=1):
+                batch_start_time = time.perf_counter()
+
+                texts = [doc.page_content for doc in batch]
+                vectors = np.asarray(
+                    self.embedding.embed_documents(texts), dtype=np.float32
+                )
+
+                if vectorstore is None:
+                    vectorstore = FAISS(
+                        embedding_function=self.embedding,
+                        index=faiss.IndexFlatL2(vectors.shape[1]),
+                        docstore=ChunkDocstore(store=store),
+                        index_to_docstore_id={},
+                    )
+
+                vectorstore.index.add(vectors)
+                first_chunk = len(store)
+                for doc in batch:
+                    chunk = store.append(
+                        text=doc.page_content,
+                        title=doc.metadata["title"],
+                        start_index=doc.metadata.get("start_index"),
+                    )
+                    # ベクトルのidはチャンクのidと揃える
+                    vectorstore.index_to_docstore_id[chunk] = str(chunk)
+                if catalog is not None:
+                    catalog.write(store=store, start=first_chunk, end=len(store))
+
+                elapsed = time.perf_counter() - batch_start_time
+                logging.info(
+                    f"バッチ{i}: {len(batch)}チャンク追加 "
+                    f"({len(batch) / elapsed:.1f}チャンク/秒, 累計{len(store)}チャンク, "
+                    f"経過{time.perf_counter() - start_time:.1f}秒)"
+                )
+
+            if catalog is not None:
+                catalog.close()
+                self._catalog_path = catalog.path
+        finally:
+            # 途中で失敗した場合も書き込みスレッドを止めて一時ファイルを削除する
+            if catalog is not None:
+                catalog.abort()
+
+        if vectorstore is None:
+            raise ValueError(f"チャンクが1つもありません: {self.mode}")
+
+        # チャンクの文章は最後に1回だけ連結し、検索時や保存時に連結し直さないようにする
+        store.flush()
+
+        return vectorstore
+
+    def _deduplicate(
+        self, documents: Iterator[Document], store: ChunkStore
+    ) -> Iterator[Document]:
+        """
+        説明
+        ----------
+        MinHashとLSHでほぼ同じチャンクを見つけ、最初に出てきたものだけを返すジェネレータ
+        取り除いたチャンクの元の位置は代表のチャンクの重複としてstoreに記録する
+
+        Parameters
+        ----------
+        documents : Iterator[Document]
+            チャンク分割したドキュメント
+        store : ChunkStore
+            チャンクを保持する配列
+
+        Returns
+        ----------
+        Iterator[Document]
+            重複していないチャンク
+        """
 
-        self.embedding = init_embedding_model()
-        self.documents = make_documents(
-            text_list=text_list, first_line_list=first_line_list, mode=self.mode
+        config = self.config["Deduplication"]
+        deduplicator = MinHashDeduplicator(
+            num_perm=config["num_perm"],
+            bands=config["bands"],
+            shingle_size=config["shingle_size"],
+            threshold=config["threshold"],
         )
 
+        total = 0
+        removed = 0
+
+        for doc in documents:
+            total += 1
+            representative = deduplicator.add(text=doc.page_content)
+            if representative is None:
+                yield doc
+            else:
+                removed += 1
+                store.add_duplicate(
+                    chunk=representative,
+                    title=doc.metadata["title"],
+                    start_index=doc.metadata.get("start_index"),
+                    length=len(doc.page_content),
+                )
+
+        logging.info(f"重複チャンクを除去: {removed}/{total}チャンク")
+
     def search(self, query: str, tops: int) -> List[Document]:
         """
         説明
@@ -107,27 +310,642 @@ class NormalSearch:
         """
 
         logging.info("検索中...")
-        results = self.vectorstore.similarity_search(query=query, k=tops)
+        results = self.search_batch(queries=[query], tops=tops)[0]
         logging.info("検索完了！")
 
         return results
 
+    def search_batch(self, queries: List[str], tops: int) -> List[List[Document]]:
+        """
+        説明
+        ----------
+        複数のクエリをまとめてエンベディングし、関連するドキュメントを検索する
+
+        Parameters
+        ----------
+        queries : List[str]
+            クエリのリスト
+        tops : int
+            検索上位の何個を結果に含めるか
+
+        Returns
+        ----------
+        List[List[Document]]
+            各クエリに関連するドキュメントのリスト
+        """
+
+        return [
+            [doc for doc, _ in results]
+            for results in self.search_batch_with_scores(queries=queries, tops=tops)
+        ]
+
+    def search_with_scores(self, query: str, tops: int) -> List[Tuple[Document, float]]:
+        """
+        説明
+        ----------
+        与えられたクエリから関連するドキュメントをスコアと一緒に検索する
+        スコアはFAISSのsimilarity_search_with_scoreと同じ(L2距離、小さいほど近い)
+
+        Parameters
+        ----------
+        query : str
+            クエリ
+        tops : int
+            検索上位の何個を結果に含めるか
+
+        Returns
+        ----------
+        List[Tuple[Document, float]]
+            関連するドキュメントとスコアのリスト
+        """
+
+        return self.search_batch_with_scores(queries=[query], tops=tops)[0]
+
+    def search_batch_with_scores(
+        self, queries: List[str], tops: int
+    ) -> List[List[Tuple[Document, float]]]:
+        """
+        説明
+        ----------
+        複数のクエリに関連するドキュメントをスコアと一緒に検索する
+
+        Parameters
+        ----------
+        queries : List[str]
+            クエリのリスト
+        tops : int
+            検索上位の何個を結果に含めるか
+
+        Returns
+        ----------
+        List[List[Tuple[Document, float]]]
+            各クエリに関連するドキュメントとスコアのリスト
+        """
+
+        snapshot = self._snapshot()
+        docstore = snapshot.vectorstore.docstore
+
+        return [
+            [(docstore.search(id), score) for id, score in hits]
+            for hits in self._retrieve(queries=queries, tops=tops, snapshot=snapshot)
+        ]
+
+    def _snapshot(self) -> IndexSnapshot:
+        """
+        説明
+        ----------
+        現在のインデックス一式を取得するメソッド
+
+        Returns
+        ----------
+        IndexSnapshot
+            ベクトルストア・シャード・インデックスのキー
+        """
+
+        with self._swap_lock:
+            return IndexSnapshot(
+                vectorstore=self.vectorstore,
+                shards=self.shards,
+                index_key=self.index_key,
+            )
+
+    def _cache(self) -> Optional[RetrievalCache]:
+        """
+        説明
+        ----------
+        キャッシュが有効な場合はキャッシュを返すメソッド
+
+        Returns
+        ----------
+        Optional[RetrievalCache]
+            キャッシュ(無効な場合はNone)
+        """
+
+        if self.config["RetrievalCache"]["enabled"]:
+            return RETRIEVAL_CACHE
+
+        return None
+
+    def _embed_queries(self, queries: List[str]) -> np.ndarray:
+        """
+        説明
+        ----------
+        クエリをエンベディングするメソッド
+        キャッシュにないクエリだけをまとめてエンベディングする
+
+        Parameters
+        ----------
+        queries : List[str]
+            クエリのリスト
+
+        Returns
+        ----------
+        np.ndarray
+            クエリの埋め込み(クエリ数×次元数)
+        """
+
+        cache = self._cache()
+        model_name = self.config["HuggingFaceEmbeddings"]["model_name"]
+
+        embeddings = {}
+        if cache is not None:
+            embeddings = cache.get_embeddings(model_name=model_name, queries=queries)
+
+        missing = [query for query in dict.fromkeys(queries) if query not in embeddings]
+        if len(missing) > 0:
+            vectors = self.embedding.embed_documents(missing)
+            new_embeddings = {
+                query: np.asarray(vector, dtype=np.float32)
+                for query, vector in zip(missing, vectors)
+            }
+            if cache is not None:
+                cache.put_embeddings(model_name=model_name, embeddings=new_embeddings)
+            embeddings.update(new_embeddings)
+
+        return np.stack([embeddings[query] for query in queries])
+
+    def _search_by_vectors(
+        self, vectors: np.ndarray, tops: int, snapshot: Optional[IndexSnapshot] = None
+    ) -> List[List[Tuple[str, float]]]:
+        """
+        説明
+        ----------
+        FAISSのインデックスを直接検索し、ドキュメントのidとスコアを返すメソッド
+
+        Parameters
+        ----------
+        vectors : np.ndarray
+            クエリの埋め込み(クエリ数×次元数)
+        tops : int
+            検索上位の何個を結果に含めるか
+        snapshot : Optional[IndexSnapshot] = None
+            検索するインデックス一式(Noneの場合は現在のもの)
+
+        Returns
+        ----------
+        List[List[Tuple[str, float]]]
+            各クエリの(ドキュメントのid, スコア)のリスト(スコア順)
+        """
+
+        vectorstore, shards, _ = snapshot or self._snapshot()
+
+        if vectorstore._normalize_L2:
+            vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+        if shards is None:
+            return self._search_index(
+                index=vectorstore.index,
+                ids=vectorstore.index_to_docstore_id,
+                vectors=vectors,
+                tops=tops,
+            )
+
+        # 各シャードを並列に検索し、シャードごとの上位tops件をヒープでマージする
+        # スレッドプールは作り直されることがあるので、ロックの中で現在のものに投入する
+        with self._swap_lock:
+            executor = self._reserve_workers(n_workers=len(shards))
+            futures = [
+                executor.submit(
+                    self._search_index, index=index, ids=ids, vectors=vectors, tops=tops
+                )
+                for index, ids in shards
+            ]
+        partial_results = [future.result() for future in futures]
+
+        reverse = vectorstore.distance_strategy == DistanceStrategy.MAX_INNER_PRODUCT
+
+        return [
+            list(
+                islice(
+                    heapq.merge(*hits_list, key=lambda hit: hit[1], reverse=reverse),
+                    tops,
+                )
+            )
+            for hits_list in zip(*partial_results)
+        ]
+
+    def _search_index(
+        self,
+        index: faiss.Index,
+        ids: Union[Dict[int, str], List[str]],
+        vectors: np.ndarray,
+        tops: int,
+    ) -> List[List[Tuple[str, float]]]:
+        """
+        説明
+        ----------
+        1つのFAISSのインデックスを検索し、ドキュメントのidとスコアを返すメソッド
+
+        Parameters
+        ----------
+        index : faiss.Index
+            FAISSのインデックス
+        ids : Union[Dict[int, str], List[str]]
+            インデックス内の位置からドキュメントのidへの対応
+        vectors : np.ndarray
+            クエリの埋め込み(クエリ数×次元数)
+        tops : int
+            検索上位の何個を結果に含めるか
+
+        Returns
+        ----------
+        List[List[Tuple[str, float]]]
+            各クエリの(ドキュメントのid, スコア)のリスト(スコア順)
+        """
+
+        scores, indices = index.search(vectors, tops)
+
+        return [
+            [
+                (ids[i], float(score))
+                for i, score in zip(row_indices, row_scores)
+                if i != -1
+            ]
+            for row_indices, row_scores in zip(indices, scores)
+        ]
+
+    def _setup_shards(self) -> None:
+        """
+        説明
+        ----------
+        設定のシャード数が2以上であればインデックスを分割するメソッド
+        """
+
+        shards = self._configured_shards(vectorstore=self.vectorstore)
+
+        with self._swap_lock:
+            self.shards = shards
+            if shards is not None:
+                self._reserve_workers(n_workers=len(shards))
+
+    def _configured_shards(
+        self, vectorstore: FAISS
+    ) -> Optional[List[Tuple[faiss.Index, List[str]]]]:
+        """
+        説明
+        ----------
+        設定に従ってベクトルストアを分割するメソッド
+
+        Parameters
+        ----------
+        vectorstore : FAISS
+            ベクトルストア
+
+        Returns
+        ----------
+        Optional[List[Tuple[faiss.Index, List[str]]]]
+            シャード(シャード数が1以下の場合はNone)
+        """
+
+        config = self.config["NormalSearch"]
+
+        if config["n_shards"] <= 1:
+            return None
+
+        return self._make_shards(
+            vectorstore=vectorstore, n_shards=config["n_shards"], by=config["shard_by"]
+        )
+
+    def _reserve_workers(self, n_workers: int) -> ThreadPoolExecutor:
+        """
+        説明
+        ----------
+        シャードを検索するスレッドプールを用意するメソッド(_swap_lockを取得して呼ぶ)
+        スレッドプールはインスタンスごとに1つで、シャードの作り直しやバージョンの
+        切り替えでも使い回す。スレッド数が足りない場合だけ作り直し、古いものは閉じる
+        各スレッドでFAISS(OpenMP)が使うスレッド数はCPUを分け合うように制限する
+
+        Parameters
+        ----------
+        n_workers : int
+            必要なスレッド数
+
+        Returns
+        ----------
+        ThreadPoolExecutor
+            スレッドプール
+        """
+
+        if self._executor is not None and self._executor_workers >= n_workers:
+            return self._executor
+
+        if self._executor is not None:
+            # 投入済みの検索は最後まで実行される
+            self._executor.shutdown(wait=False)
+
+        # シャード数×OpenMPのスレッド数がCPU数を超えないようにする
+        # (omp_set_num_threadsは呼び出したスレッドにだけ効く)
+        omp_threads = max(1, faiss.omp_get_max_threads() // n_workers)
+        self._executor = ThreadPoolExecutor(
+            max_workers=n_workers,
+            initializer=faiss.omp_set_num_threads,
+            initargs=(omp_threads,),
+        )
+        self._executor_workers = n_workers
+
+        return self._executor
+
+    def shard(self, n_shards: int, by: str = "range") -> None:
+        """
+        説明
+        ----------
+        インデックスを複数のシャードに分割するメソッド
+        検索時は各シャードをスレッドプールで並列に検索し、結果をマージする
+        マージ後の結果は分割しない場合と同じになる(スコアが同点の場合の順番は除く)
+        各シャードはベクトルのコピーを持ち、保存と分割し直しのために元のインデックスも
+        残すので、ベクトルのメモリ使用量は分割しない場合の約2倍になる
+
+        Parameters
+        ----------
+        n_shards : int
+            シャード数(1未満の場合はValueError)
+        by : str = "range"
+            "range"の場合はチャンクの順番で連続する範囲ごとに、
+            "source"の場合は元のtxtファイル(タイトル)ごとに分割する
+        """
+
+        shards = self._make_shards(
+            vectorstore=self.vectorstore, n_shards=n_shards, by=by
+        )
+
+        with self._swap_lock:
+            self.shards = shards
+            self._reserve_workers(n_workers=n_shards)
+
+    def _make_shards(
+        self, vectorstore: FAISS, n_shards: int, by: str
+    ) -> List[Tuple[faiss.Index, List[str]]]:
+        """
+        説明
+        ----------
+        ベクトルストアのインデックスを分割したシャードを作成するメソッド
+        全ベクトルを一度にコピーせず、シャードごとに必要なベクトルだけを取り出す
+
+        Parameters
+        ----------
+        vectorstore : FAISS
+            ベクトルストア
+        n_shards : int
+            シャード数
+        by : str
+            "range"か"source"(shardメソッドを参照)
+
+        Returns
+        ----------
+        List[Tuple[faiss.Index, List[str]]]
+            分割したインデックスとその中のベクトルのドキュメントid
+        """
+
+        if n_shards < 1:
+            raise ValueError(f"n_shardsは1以上を指定してください: {n_shards}")
+
+        index = vectorstore.index
+        ntotal = index.ntotal
+
+        ids = [vectorstore.index_to_docstore_id[i] for i in range(ntotal)]
+
+        if by == "range":
+            assignments = np.arange(ntotal) * n_shards // max(ntotal, 1)
+        elif by == "source" and isinstance(vectorstore.docstore, ChunkDocstore):
+            # タイトルの番号の配列をそのまま使う
+            title_ids = vectorstore.docstore.store.title_ids
+            chunks = vectorstore.docstore.chunk_numbers(ids=ids)
+            assignments = title_ids[chunks] % n_shards
+        elif by == "source":
+            titles = [vectorstore.docstore.search(id).metadata["title"] for id in ids]
+            title_numbers = {title: i for i, title in enumerate(dict.fromkeys(titles))}
+            assignments = np.array(
+                [title_numbers[title] % n_shards for title in titles]
+            )
+        else:
+            raise ValueError(f"byは'range'か'source'を指定してください: {by}")
+
+        shards = []
+        for shard_id in range(n_shards):
+            positions = np.flatnonzero(assignments == shard_id)
+            shard_index = faiss.IndexFlat(index.d, index.metric_type)
+            if len(positions) > 0:
+                shard_index.add(index.reconstruct_batch(positions))
+            shards.append((shard_index, [ids[position] for position in positions]))
+
+        logging.info(
+            f"インデックスを{n_shards}個に分割: "
+            f"{[shard_index.ntotal for shard_index, _ in shards]}"
+        )
+
+        return shards
+
+    def swap(self, path: str) -> bool:
+        """
+        説明
+        ----------
+        別のバージョンのインデックスに切り替えるメソッド
+        読み込みと分割は切り替え前に済ませ、参照の差し替えだけをロックの中で行うので、
+        検索は止まらない(実行中の検索は切り替え前のインデックスで最後まで行われる)
+
+        Parameters
+        ----------
+        path : str
+            バージョンのpath
+
+        Returns
+        ----------
+        bool
+            切り替えた場合はTrue(エンベディングモデルやチャンクの設定が異なる場合はFalse)
+        """
+
+        # 検索時のクエリの埋め込みやチャンクの作り方が異なるインデックスには切り替えない
+        metadata = REGISTRY.metadata(path=path)
+        expected = {
+            "embedding": self.config["HuggingFaceEmbeddings"]["model_name"],
+            "splitter": self.config["RecursiveCharacterTextSplitter"],
+            "deduplication": self.config["Deduplication"],
+        }
+        for name, value in expected.items():
+            if metadata.get(name) != value:
+                logging.warning(
+                    f"{name}の設定が異なるため切り替えません: {path}"
+                    f"({metadata.get(name)} != {value})"
+                )
+                return False
+
+        identity = REGISTRY.identity_of(path=path, mode=self.mode, config=self.config)
+        vectorstore = REGISTRY.load_version(path=path, config=self.config)
+        shards = self._configured_shards(vectorstore=vectorstore)
+
+        with self._swap_lock:
+            self.vectorstore = vectorstore
+            self.shards = shards
+            if shards is not None:
+                self._reserve_workers(n_workers=len(shards))
+            self.identity = identity
+            self.index_key = REGISTRY.key_of(identity=identity)
+            self.version = path
+            # チャンクの一覧は切り替え先のバージョンのものを使う
+            self._catalog_path = None
+
+        logging.info(f"インデックスを切り替えました: {path}")
+
+        return True
+
+    def watch(self, interval: Optional[float] = None) -> None:
+        """
+        説明
+        ----------
+        同じmodeで新しいバージョンが公開されたら、
+        バックグラウンドのスレッドで読み込んで切り替えるメソッド
+
+        Parameters
+        ----------
+        interval : Optional[float] = None
+            公開されたバージョンを確認する間隔(秒)(Noneの場合はconfig.jsonの設定)
+        """
+
+        if self._watcher is not None:
+            return
+
+        interval = interval or self.config["NormalSearch"]["watch_interval"]
+        stop = threading.Event()
+
+        def run() -> None:
+            skipped = None
+            while not stop.wait(interval):
+                try:
+                    path = REGISTRY.latest(mode=self.mode)
+                    if path is None or path in (self.version, skipped):
+                        continue
+                    if not self.swap(path=path):
+                        skipped = path
+                except Exception:
+                    logging.exception("インデックスの切り替えに失敗しました")
+
+        thread = threading.Thread(target=run, name="index-watcher", daemon=True)
+        thread.start()
+        self._watcher = (thread, stop)
+
+    def unwatch(self) -> None:
+        """
+        説明
+        ----------
+        新しいバージョンの監視をやめるメソッド
+        """
+
+        if self._watcher is None:
+            return
+
+        thread, stop = self._watcher
+        stop.set()
+        thread.join()
+        self._watcher = None
+
+    def _retrieve(
+        self, queries: List[str], tops: int, snapshot: Optional[IndexSnapshot] = None
+    ) -> List[List[Tuple[str, float]]]:
+        """
+        説明
+        ----------
+        各クエリの検索結果のidとスコアを求めるメソッド
+        キャッシュにtops件以上の結果があればその先頭を使い、
+        なければ検索し直してより深い結果としてキャッシュを更新する
+
+        Parameters
+        ----------
+        queries : List[str]
+            クエリのリスト
+        tops : int
+            検索上位の何個を結果に含めるか
+        snapshot : Optional[IndexSnapshot] = None
+            検索するインデックス一式(Noneの場合は現在のもの)
+
+        Returns
+        ----------
+        List[List[Tuple[str, float]]]
+            各クエリの(ドキュメントのid, スコア)のリスト(スコア順)
+        """
+
+        snapshot = snapshot or self._snapshot()
+        cache = self._cache()
+        ntotal = snapshot.vectorstore.index.ntotal
+
+        results: Dict[str, List[Tuple[str, float]]] = {}
+
+        if cache is not None:
+            for query in set(queries):
+                cached = cache.get_results(index_key=snapshot.index_key, query=query)
+                if cached is None:
+                    continue
+                ids, scores = cached
+                if len(ids) >= tops or len(ids) == ntotal:
+                    results[query] = list(zip(ids, scores))
+
+        missing = [query for query in dict.fromkeys(queries) if query not in results]
+        if len(missing) > 0:
+            vectors = self._embed_queries(queries=missing)
+            for query, hits in zip(
+                missing,
+                self._search_by_vectors(vectors=vectors, tops=tops, snapshot=snapshot),
+            ):
+                results[query] = hits
+            if cache is not None:
+                cache.put_results(
+                    index_key=snapshot.index_key,
+                    results={
+                        query: (
+                            [id for id, _ in results[query]],
+                            [score for _, score in results[query]],
+                        )
+                        for query in missing
+                    },
+                )
+
+        return [results[query][:tops] for query in queries]
+
     def save(self) -> None:
         """
         説明
         ----------
         ベクトルストアの保存を行うメソッド
+        保存先は作成時(読み込んだ場合は読み込んだバージョンの作成時)の
+        コーパスと設定のハッシュ値で決まり、新しいバージョンとして公開される
+        チャンクの一覧のParquetファイルも同じバージョンに含める
         """
 
-        self.vectorstore.save_local(folder_path=self.path)
+        if self.identity is None:
+            raise ValueError("作成時のコーパスと設定が分からないインデックスは保存できません")
+
+        # 作成時に書き込んだものが無ければ、読み込んだバージョンのものを引き継ぐ
+        catalog_path = self._catalog_path
+        if catalog_path is None and self.version is not None:
+            catalog_path = os.path.join(self.version, CATALOG_FILE_NAME)
+        files = {}
+        if catalog_path is not None and os.path.isfile(catalog_path):
+            # 作成後にチャンクを追加・削除した場合はidが合わなくなるので公開しない
+            if count_rows(path=catalog_path) == self.vectorstore.index.ntotal:
+                files[CATALOG_FILE_NAME] = catalog_path
+            else:
+                logging.warning(f"チャンクの一覧がインデックスと一致しないため保存しません: {catalog_path}")
+
+        self.version = REGISTRY.save(
+            vectorstore=self.vectorstore,
+            mode=self.mode,
+            config=self.config,
+            files=files,
+            identity=self.identity,
+        )
+
+        # 作り直したインデックスに古い検索結果を使わないようにする
+        cache = self._cache()
+        if cache is not None:
+            cache.clear(index_key=self.index_key)
 
     @classmethod
-    def load(cls, mode: str = "valid"):
+    def load(cls, mode: str = "valid", config: Optional[Dict] = None):
         """
         説明
         ----------
         保存したベクトルストアを読み込むメソッド
         __init__でインスタンス化したくないのでこれを実装
+        同じプロセス内で読み込み済みのベクトルストアは再利用する
 
         Parameters
         ----------
@@ -135,8 +953,11 @@ class NormalSearch:
             このメソッドが呼び出されるクラス（NormalSearchまたはそのサブクラス）の型。
             クラスメソッドの第一引数として自動的に渡されます。
 
-        path : str
-            ベクトルストアを保存しているディレクトリまでのpath
+        mode : str = "valid"
+            検証用かテスト用か区別するためのもの
+
+        config : Optional[Dict] = None
+            使用する設定(Noneの場合はconfig.jsonの設定)
 
         Returns
         ----------
@@ -144,24 +965,79 @@ class NormalSearch:
             NNormalSearchクラス（またはそのサブクラス）のインスタンス
         """
 
-        chunk_size = CONFIG["RecursiveCharacterTextSplitter"]["chunk_size"]
-        chunk_overlap = CONFIG["RecursiveCharacterTextSplitter"]["chunk_overlap"]
+        config = config or CONFIG
 
-        if mode == "valid":
-            path = f"vectorstore/{mode}"
-        elif mode == "test":
-            path = (
-                f"vectorstore/{mode}/chunk_size{chunk_size}chunk_overlap{chunk_overlap}"
-            )
-        else:
-            path = "vectorstore/valid"
+        version = REGISTRY.resolve(mode=mode, config=config)
+        return cls.from_vectorstore(
+            vectorstore=REGISTRY.load_version(path=version, config=config),
+            mode=mode,
+            config=config,
+            identity=REGISTRY.identity_of(path=version, mode=mode, config=config),
+            version=version,
+        )
+
+    @classmethod
+    def from_vectorstore(
+        cls,
+        vectorstore: FAISS,
+        mode: str = "valid",
+        config: Optional[Dict] = None,
+        index_key: Optional[str] = None,
+        identity: Optional[Dict] = None,
+        version: Optional[str] = None,
+    ):
+        """
+        説明
+        ----------
+        作成済みのベクトルストアからインスタンスを作成するメソッド
+        インデックスの作成は行わず、検索に必要な状態だけを初期化する
+
+        Parameters
+        ----------
+        vectorstore : FAISS
+            使用するベクトルストア
+
+        mode : str = "valid"
+            検証用かテスト用か区別するためのもの
+
+        config : Optional[Dict] = None
+            使用する設定(Noneの場合はconfig.jsonの設定)
+
+        index_key : Optional[str] = None
+            キャッシュなどで使うインデックスのキー(Noneの場合はidentityから作成)
+
+        identity : Optional[Dict] = None
+            インデックスの作成時のコーパスと設定
+            index_keyもidentityもNoneの場合は現在のコーパスと設定を使う
+
+        version : Optional[str] = None
+            読み込んだバージョンのpath(レジストリを経由しない場合はNone)
+
+        Returns
+        ----------
+        NormalSearch
+            NormalSearchクラス（またはそのサブクラス）のインスタンス
+        """
+
+        config = config or CONFIG
 
         instance = cls.__new__(cls)
-        instance.embedding = init_embedding_model()
-        instance.vectorstore = FAISS.load_local(
-            folder_path=path,
-            embeddings=instance.embedding,
-            allow_dangerous_deserialization=True,
-        )
+        instance.mode = mode
+        instance.config = config
+        if index_key is None:
+            if identity is None:
+                identity = REGISTRY.identity(mode=mode, config=config)
+            index_key = REGISTRY.key_of(identity=identity)
+        instance.identity = identity
+        instance.index_key = index_key
+        instance.version = version
+        instance.vectorstore = vectorstore
+        instance._swap_lock = threading.Lock()
+        instance._watcher = None
+        instance._executor = None
+        instance._executor_workers = 0
+        instance._catalog_path = None
+        instance.embedding = vectorstore.embedding_function
+        instance._setup_shards()
 
         return instance
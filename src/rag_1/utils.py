@@ -1,8 +1,8 @@
 import json
 import os
 import re
-from pathlib import Path
-from typing import List, Tuple
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
 import numpy as np
 import pandas as pd
@@ -11,10 +11,14 @@ from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from tqdm import tqdm
 
-JSON_PATH = "src/rag_1/config/config.json"
+# 実行時のカレントディレクトリに依存しないようにこのファイルからの相対pathにする
+JSON_PATH = os.path.join(os.path.dirname(__file__), "config", "config.json")
 with open(JSON_PATH, "r", encoding="utf-8") as file:
     CONFIG = json.load(file)
 
+# 提出できる回答・エビデンスの最大文字数
+MAX_ANSWER_LENGTH = 48
+
 
 def cosine_similarity(vec1: List[float], vec2: List[float]) -> float:
     """
@@ -43,12 +47,17 @@ def cosine_similarity(vec1: List[float], vec2: List[float]) -> float:
     return dot_product / (norm_vec1 * norm_vec2)
 
 
-def init_embedding_model() -> HuggingFaceEmbeddings:
+def init_embedding_model(config: Optional[Dict] = None) -> HuggingFaceEmbeddings:
     """
     説明
     ----------
     HuggingFaceのEmbeddingモデルをロードし、返す関数
 
+    Parameter
+    ----------
+    config : Optional[Dict] = None
+        使用する設定(Noneの場合はconfig.jsonの設定)
+
     Returns
     ----------
     HugginFaceEmbeddings
@@ -57,44 +66,44 @@ def init_embedding_model() -> HuggingFaceEmbeddings:
     """
 
     # ハイパーパラメータの取得
-    config = CONFIG["HuggingFaceEmbeddings"]
-    model_name = config["model_name"]  # 使用するモデル名
+    settings = (config or CONFIG)["HuggingFaceEmbeddings"]
+    model_name = settings["model_name"]  # 使用するモデル名
 
     hf = HuggingFaceEmbeddings(model_name=model_name)
 
     return hf
 
 
-def make_documents(
-    text_list: List[str], first_line_list: List[str], mode: str = "valid"
-) -> List[Document]:
+def make_text_splitter(
+    config: Optional[Dict] = None,
+) -> RecursiveCharacterTextSplitter:
     """
     説明
     ----------
-    textを分割し、Documentとして返す。
+    設定からテキストスプリッターを作成する関数
 
     Parameter
     ----------
-    text_list : List[str]
-        リスト型の文章
+    config : Optional[Dict] = None
+        使用する設定(Noneの場合はconfig.jsonの設定)
 
     Returns
     ----------
-    langchain_core.documents.Document
-        Document型のデータ
+    RecursiveCharacterTextSplitter
+        テキストスプリッター
 
     """
 
     # ハイパーパラメータの取得
-    config = CONFIG["RecursiveCharacterTextSplitter"]
-    chunk_size = config["chunk_size"]  # 1チャンクに含める最大文字数
-    chunk_overlap = config["chunk_overlap"]  # 隣接するチャンク間で重複する文字数
-    keep_separator = config["keep_separator"]  # 分割に使用したセパレータをチャンクに保持するか
-    add_start_index = config[
+    settings = (config or CONFIG)["RecursiveCharacterTextSplitter"]
+    chunk_size = settings["chunk_size"]  # 1チャンクに含める最大文字数
+    chunk_overlap = settings["chunk_overlap"]  # 隣接するチャンク間で重複する文字数
+    keep_separator = settings["keep_separator"]  # 分割に使用したセパレータをチャンクに保持するか
+    add_start_index = settings[
         "add_start_index"
     ]  # 各チャンクのメタデータにそのチャンクが元のテキストデータのどこから始めるかを含めるかどうか
-    strip_whitespace = config["strip_whitespace"]  # 各チャンクの銭湯や末尾にある不要な空白文字を削除するかどうか
-    separators = config["separators"]  # チャンクに分ける際に使用する文字
+    strip_whitespace = settings["strip_whitespace"]  # 各チャンクの銭湯や末尾にある不要な空白文字を削除するかどうか
+    separators = settings["separators"]  # チャンクに分ける際に使用する文字
 
     text_splitter = RecursiveCharacterTextSplitter(
         chunk_size=chunk_size,
@@ -105,128 +114,120 @@ def make_documents(
         separators=separators,
     )
 
-    documents_list = []
-
-    for text, first_line in zip(text_list, first_line_list):
-        metadata = {"title": first_line}
-        doc_list = text_splitter.create_documents([text], [metadata])
-        documents_list.extend(doc_list)
-
-    make_csv_xlsx(documents=documents_list, mode=mode)
-
-    return documents_list
+    return text_splitter
 
 
-def get_text(mode: str) -> Tuple[List[str], List[str]]:
+def iter_documents(mode: str, config: Optional[Dict] = None) -> Iterator[Document]:
     """
     説明
     ----------
-    datasetから文章を取得し、リストとして返す。
+    txtファイルを1つずつ読み込んで分割し、Documentを1つずつ返すジェネレータ
+    メモリ上には1つのtxtファイル分のチャンクしか保持しない
 
     Parameter
     ----------
     mode : str
         検証用かテスト用か区別するためのもの
+    config : Optional[Dict] = None
+        使用する設定(Noneの場合はconfig.jsonの設定)
 
     Returns
     ----------
-    List[str]
-        各txtファイルから取り出した文章をリストとして保管したもの
+    Iterator[Document]
+        Document型のデータ
 
     """
 
-    doc_list = []
-    first_line_list = []
+    text_splitter = make_text_splitter(config=config)
 
-    if mode == "valid":
-        with open("dataset/validation/novel.txt", "r", encoding="utf-8") as file:
-            document = file.read()
-        first_line = document.splitlines()[0]
-        document = re.sub(r"-{55}.*?-{55}", "", document, flags=re.DOTALL)
-        document = re.sub(r"\［.*?\］", "", document)
-        document = document.replace("\n", "").replace("\u3000", "").replace(" ", "")
-        doc_list.append(document)
-        first_line_list.append(first_line)
-    elif mode == "test":
-        for i in range(1, 8):
-            with open(f"dataset/novels/{i}.txt", "r") as file:
-                document = file.read()
-            first_line = document.splitlines()[0]
-            document = re.sub(r"-{55}.*?-{55}", "", document, flags=re.DOTALL)
-            document = re.sub(r"\［.*?\］", "", document)
-            document = document.replace("\n", "").replace("\u3000", "").replace(" ", "")
-            doc_list.append(document)
-            first_line_list.append(first_line)
-
-    return doc_list, first_line_list
+    for text, first_line in iter_text(mode=mode):
+        metadata = {"title": first_line}
+        yield from text_splitter.create_documents([text], [metadata])
 
 
-def make_csv_xlsx(documents: List[Document], mode: str = "valid") -> None:
+def batched(items: Iterable, batch_size: int) -> Iterator[List]:
     """
     説明
     ----------
-    documentsからcsvとxlsxファイルを作成する
+    要素をbatch_size個ずつまとめて返すジェネレータ
 
     Parameter
     ----------
-    documents : List[Document]
-        チャンク分割したドキュメント
+    items : Iterable
+        要素
+    batch_size : int
+        1バッチの要素数
 
-    """
+    Returns
+    ----------
+    Iterator[List]
+        バッチ
 
-    sentence_length_list = []
-    start_index_list = []
-    title_list = []
-    doc_list = []
-    id_list = []
+    """
 
-    id = 0
+    iterator = iter(items)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
 
-    for doc in documents:
-        d = doc.page_content
-        start_index = doc.metadata["start_index"]
-        title = doc.metadata["title"]
 
-        doc_list.append(d)
-        start_index_list.append(start_index)
-        title_list.append(title)
-        sentence_length_list.append(len(d))
-        id_list.append(id)
+def get_corpus_paths(mode: str) -> List[str]:
+    """
+    説明
+    ----------
+    modeに対応するdatasetのtxtファイルのpathを返す。
 
-        id += 1
+    Parameter
+    ----------
+    mode : str
+        検証用かテスト用か区別するためのもの
 
-    data = {
-        "chunk_id": id_list,
-        "title": title_list,
-        "document": doc_list,
-        "start_index": start_index_list,
-        "length": sentence_length_list,
-    }
+    Returns
+    ----------
+    List[str]
+        txtファイルのpathのリスト
 
-    df = pd.DataFrame(data)
+    """
 
     if mode == "valid":
-        folder_path = "dataset/chunk/valid"
+        return ["dataset/validation/novel.txt"]
     elif mode == "test":
-        folder_path = "dataset/chunk/test"
+        return [f"dataset/novels/{i}.txt" for i in range(1, 8)]
 
-    Path(folder_path).mkdir(parents=True, exist_ok=True)
+    raise ValueError(f"modeは'valid'か'test'を指定してください: {mode}")
 
-    df.to_csv(os.path.join(folder_path, "chunk.csv"), index=False)
-    df.to_excel(os.path.join(folder_path, "chunk.xlsx"), index=False)
 
+def iter_text(mode: str) -> Iterator[Tuple[str, str]]:
+    """
+    説明
+    ----------
+    datasetのtxtファイルを1つずつ読み込み、整形した文章と1行目を返すジェネレータ
 
-if __name__ == "__main__":
-    # documents = get_text(mode="valid")
+    Parameter
+    ----------
+    mode : str
+        検証用かテスト用か区別するためのもの
 
-    # doc_list = make_documents(documents)
+    Returns
+    ----------
+    Iterator[Tuple[str, str]]
+        各txtファイルから取り出した文章と1行目(タイトル)
 
-    # print(doc_list)
-    # for doc in doc_list:
-    #     print(len(doc.page_content))
-    #     # print(doc)
-    # print(len(doc_list))
+    """
 
+    for path in get_corpus_paths(mode=mode):
+        with open(path, "r", encoding="utf-8") as file:
+            document = file.read()
+        first_line = document.splitlines()[0]
+        document = re.sub(r"-{55}.*?-{55}", "", document, flags=re.DOTALL)
+        document = re.sub(r"\［.*?\］", "", document)
+        document = document.replace("\n", "").replace("\u3000", "").replace(" ", "")
+        yield document, first_line
+
+
+if __name__ == "__main__":
     # 元の文字列
     # text = "でも自分のよくなりつつあるという暗示を得たいという二つの事柄なのであった。"
     # print(len(text))
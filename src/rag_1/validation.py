@@ -1,6 +1,6 @@
 import os
 from pathlib import Path
-from typing import List, Tuple, Union
+from typing import List, Optional, Tuple, Union
 
 import pandas as pd
 from langchain_core.documents import Document
@@ -18,7 +18,7 @@ class Validation:
         検索クラス
 
     self.df : DataFrame
-        query(質問文)が記載されているデータフレーム
+        query(質問文)が記載されているデータフレーム(初めて参照した時に読み込む)
 
     method
     ----------
@@ -38,16 +38,38 @@ class Validation:
         各クエリに対して、検索ランキングを作成し、xlsx,csvファイルで保存する
     """
 
-    def __init__(self, mode: str = "valid") -> None:
+    def __init__(
+        self, mode: str = "valid", search: Optional[NormalSearch] = None
+    ) -> None:
         """
         説明
         ----------
         各クエリに対して検索の検証を行うクラス
+
+        Parameters
+        ----------
+        mode : str = "valid"
+            検証用かテスト用か区別するためのもの
+        search : Optional[NormalSearch] = None
+            検索クラス(Noneの場合は保存したベクトルストアを読み込む)
         """
 
         self.mode = mode
-        self.search = NormalSearch.load(mode=mode)
-        self.df = self._load_df()
+        self.search = search or NormalSearch.load(mode=mode)
+        self._df: Optional[DataFrame] = None
+
+    @property
+    def df(self) -> DataFrame:
+        """
+        説明
+        ----------
+        queryが記載されているデータフレームを返す
+        """
+
+        if self._df is None:
+            self._df = self._load_df()
+
+        return self._df
 
     def _load_df(self) -> DataFrame:
         """
@@ -137,6 +159,8 @@ class Validation:
             ドキュメント内に存在するかどうか
         """
 
+        in_start_index, in_end_index = False, False
+
         if type(start_index) == int and type(end_index) == int:
             return self._exist(
                 doc_start_index=doc_start_index,
@@ -193,14 +217,21 @@ class Validation:
         i = 1
 
         for doc in result:
-            text_length = len(doc.page_content)
-            doc_start_index = doc.metadata["start_index"]
-            in_start_index, in_end_index = self._ranking(
-                doc_start_index=doc_start_index,
-                text_length=text_length,
-                start_index=start_index,
-                end_index=end_index,
-            )
+            # 重複除去でまとめられたチャンクは元の全ての位置を調べる
+            sources = [(doc.metadata["start_index"], len(doc.page_content))] + [
+                (duplicate["start_index"], duplicate["length"])
+                for duplicate in doc.metadata.get("duplicates", [])
+            ]
+            in_start_index, in_end_index = False, False
+            for doc_start_index, text_length in sources:
+                in_start_index, in_end_index = self._ranking(
+                    doc_start_index=doc_start_index,
+                    text_length=text_length,
+                    start_index=start_index,
+                    end_index=end_index,
+                )
+                if in_start_index or in_end_index:
+                    break
             if in_start_index or in_end_index:
                 rank.append(i)
                 in_start.append(in_start_index)
@@ -250,12 +281,12 @@ class Validation:
                 rank_list.append(",".join(map(str, rank)))
                 in_start_list.append(",".join(map(str, in_start)))
                 in_end_list.append(",".join(map(str, in_end)))
-                result_list.append(results)
+                result_list.append([doc.page_content for doc in results])
             else:
                 rank_list.append("None")
                 in_start_list.append("None")
                 in_end_list.append("None")
-                result_list.append(results)
+                result_list.append([doc.page_content for doc in results])
 
         df1_data = {
             "query": query_list,
@@ -310,7 +341,8 @@ class Validation:
             title = row.name
 
             results = self.search.search(query=query, tops=10)
-            result_list.append(results)
+            # Documentの文字列表現ではなくチャンクの文章を保存する
+            result_list.append([doc.page_content for doc in results])
 
             query_list.append(query)
             title_list.append(title)